@@ -5,19 +5,53 @@ from datetime import datetime, timedelta
 from docx.shared import Mm
 import io
 import base64
+import ctypes
+import gc
 import os
+import shutil
+import sys
 import zipfile
 import tempfile
+import contextlib
+import itertools
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import openpyxl
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 from student_consultation_app import (
     generate_task_description,
     generate_all_ai_content,
-    consultation_keywords
+    regenerate_ai_items,
+    consultation_keywords,
+    format_task_part,
+    build_task_description,
+    rate_limiter,
+    use_batch_rate_limit,
+    RateLimiter,
+    concurrency_limiter,
+    stage_model,
+    GENERATION_PROFILES,
+    GENERATION_STAGES,
+    DEFAULT_PROFILE
 )
+from settings import get_setting
+from document_cache import DocumentCache, ContentCache, render_key, hash_json, clear_cache, prune_cache, mark_used
+from pdf_export import PdfConverter, find_converter, is_complete_pdf
+from docx_merge import CohortMerger
+from content_validator import QualityGate, is_well_formed
+from batch_planner import plan_batch, calibrate
+from replay_store import iter_replay_file, count_replay_records, replay_line, REPLAY_FILENAME
+from prompt_templates import template_fingerprints
+import metrics
 
+@contextlib.contextmanager
 def extract_signatures(zip_file):
-    """解压签名文件到临时目录"""
-    temp_dir = tempfile.mkdtemp()
-    with zipfile.ZipFile(zip_file) as zf:
+    """解压签名文件到临时目录，退出时（包括出错时）自动删除临时目录"""
+    with tempfile.TemporaryDirectory() as temp_dir, zipfile.ZipFile(zip_file) as zf:
         # 获取文件列表
         file_list = zf.namelist()
         
@@ -31,16 +65,17 @@ def extract_signatures(zip_file):
                 decoded_name = file.encode('cp437').decode('utf-8')
                 # 提取文件
                 with zf.open(file) as source, open(os.path.join(temp_dir, decoded_name), 'wb') as target:
-                    target.write(source.read())
+                    shutil.copyfileobj(source, target)
             except Exception as e:
                 st.error(f"处理文件时出错：{str(e)}")
     
-    return temp_dir
+        yield temp_dir
 
-def process_excel_file(excel_file):
-    """读取并处理Excel文件"""
+def process_excel_file(excel_file, nrows=None):
+    """读取并处理Excel文件（nrows 指定时只读取前几行用于预览和检查列）"""
     try:
-        df = pd.read_excel(excel_file)
+        excel_file.seek(0)
+        df = pd.read_excel(excel_file, nrows=nrows)
         required_columns = [
             "论文题目", "学生姓名", "学生学号", "指导教师", 
             "专业", "学院", "开始日期", "结束日期", "补充信息"
@@ -62,128 +97,502 @@ def process_excel_file(excel_file):
         st.error(f"处理Excel文件时出错：{str(e)}")
         return None
 
-def generate_documents_for_student(row, teacher_signature_file, dean_signature_file, signatures_dir=None):
-    """为单个学生生成文档"""
+def iter_sheet_rows(excel_file):
+    """逐行读取学生信息，不把整个表格载入内存（.xls 文件仍通过 pandas 读取）"""
+    excel_file.seek(0)
+    if not excel_file.name.lower().endswith(".xlsx"):
+        for _, row in pd.read_excel(excel_file).iterrows():
+            yield {"补充信息": "", **{key: "" if pd.isna(value) else value for key, value in row.items()}}
+        return
+
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
     try:
-        # 转换日期格式
-        start_date = pd.to_datetime(row["开始日期"]).date()
-        end_date = pd.to_datetime(row["结束日期"]).date()
-        
-        # 获取学生签名图片路径（如果有）
-        student_signature_path = None
-        if signatures_dir:
-            for ext in ['.jpg', '.jpeg', '.png']:
-                path = os.path.join(signatures_dir, f"{row['学生姓名']}{ext}")
-                if os.path.exists(path):
-                    student_signature_path = path
-                    break
-        
-        # 获取补充信息，如果不存在则使用空字符串
-        additional_info = row.get("补充信息", "")
-        
-        # 生成任务书内容
-        task_content = generate_task_description(
-            row["论文题目"], 
-            row["专业"], 
-            start_date, 
-            end_date,
-            additional_info
-        )
+        values = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else "" for cell in next(values, ())]
+        for cells in values:
+            if all(cell is None for cell in cells):
+                continue
+            yield {"补充信息": "", **{key: "" if cell is None else cell for key, cell in zip(header, cells) if key}}
+    finally:
+        workbook.close()
+
+def count_sheet_rows(excel_file):
+    return sum(1 for _ in iter_sheet_rows(excel_file))
+
+def count_uploaded_rows(uploaded_file, count):
+    """每个上传的文件只计数一次，结果保存在会话状态中，页面重新运行时不再重新解析文件"""
+    counts = st.session_state.setdefault("row_counts", {})
+    if uploaded_file.file_id not in counts:
+        counts[uploaded_file.file_id] = count(uploaded_file)
+    return counts[uploaded_file.file_id]
+
+def current_rss_mb():
+    """当前进程占用的物理内存（MB）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0.0
+    # 无法读取当前值时退而使用峰值
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / 1024 / 1024 if sys.platform == "darwin" else usage / 1024
+
+try:
+    _libc = ctypes.CDLL("libc.so.6")
+except OSError:
+    _libc = None
+
+def release_memory():
+    """回收循环引用，并把空闲的堆内存还给操作系统（仅glibc有效）
+
+    渲染文档时 lxml 分配的大量小块内存释放后仍留在进程中，不定期归还时内存会随学生数缓慢增长。
+    """
+    gc.collect()
+    if _libc is not None:
+        _libc.malloc_trim(0)
+
+def over_memory_limit(memory_limit_mb):
+    """内存超过上限时先尝试回收，仍超过则返回True"""
+    if not memory_limit_mb or current_rss_mb() < memory_limit_mb:
+        return False
+    release_memory()
+    return current_rss_mb() >= memory_limit_mb
+
+TASK_TEMPLATE = "thesis_task_description_template.docx"
+RECORD_TEMPLATE = "student_consultation_template.docx"
+
+# 页面上预览的学生信息行数
+PREVIEW_ROWS = 100
+# 每渲染多少个学生归还一次空闲内存
+RELEASE_MEMORY_INTERVAL = 20
+
+# 质量检查未通过时最多重新生成的轮数
+MAX_REGENERATION_ROUNDS = 2
+
+# 生成的ZIP保存在这里供下载（不放在文档缓存中，避免挤占缓存的大小上限），超过保留天数后清理
+DOWNLOAD_DIR = get_setting("THESIS_DOWNLOAD_DIR", ".thesis_downloads")
+DOWNLOAD_MAX_AGE_DAYS = 1
+
+# 输出格式 -> 需要打包的文件类型
+OUTPUT_FORMATS = {
+    "Word": ("docx",),
+    "PDF": ("pdf",),
+    "Word和PDF": ("docx", "pdf")
+}
+
+def render_document(template_path, context, images, cache):
+    """渲染模板并写入文档缓存，返回缓存中 .docx 文件的路径
+
+    context 只包含可序列化的文本字段，images 为签名图片（字段名 -> 文件），
+    两者和模板文件一起决定缓存键，命中时直接返回已渲染的文件。
+    """
+    key = render_key(template_path, context, images)
+    cached_path = cache.lookup(key)
+    metrics.record_cache_lookup("document", cached_path is not None)
+    if cached_path:
+        return cached_path
+    template_name = os.path.splitext(os.path.basename(template_path))[0]
+
+    doc = DocxTemplate(template_path)
+    render_context = {**context, 'pagebreak': RichText('\f')}
+    for name, image in images.items():
+        render_context[name] = InlineImage(doc, image, width=Mm(20))
+    with metrics.TEMPLATE_RENDER_SECONDS.time(template=template_name):
+        doc.render(render_context)
+
+    output = io.BytesIO()
+    with metrics.DOCX_SAVE_SECONDS.time(template=template_name):
+        doc.save(output)
+    return cache.store(key, output.getvalue())
+
+def content_key(row, profile):
+    """根据学生信息和生成配置计算生成内容的缓存键"""
+    return hash_json({
+        "fields": {col: row.get(col, "") for col in ["论文题目", "学生姓名", "专业", "开始日期", "结束日期", "补充信息"]},
+        "profile": profile or DEFAULT_PROFILE,
+        # 更换模型或提示词模板变化后重新生成
+        "models": {stage: stage_model(stage) for stage in GENERATION_STAGES},
+        "prompts": template_fingerprints()
+    })
+
+def generate_task_content(row, start_date, end_date, additional_info, profile=None, usage_log=None):
+    """调用大模型生成任务书内容，并将列表转换为多行文本"""
+    task_content = generate_task_description(
+        row["论文题目"], 
+        row["专业"], 
+        start_date, 
+        end_date,
+        additional_info,
+        profile,
+        usage_log
+    )
+    
+    if not task_content:
+        return None
         
-        if not task_content:
+    # 将列表转换为多行文本
+    return {key: format_task_part(value) for key, value in task_content.items()}
+
+def generate_student_content(row, start_date, end_date, profile=None, content_cache=None, quality_gate=None, usage_log=None):
+    """生成任务书内容和咨询内容，返回 (formatted_task_content, ai_content)
+
+    传入 quality_gate 时，对生成结果做本地质量检查，并只对未通过检查的部分重新生成。
+    """
+    cache_key = content_key(row, profile)
+    cached = content_cache.load(cache_key) if content_cache else None
+    # 之前缓存的结构不完整的内容不再使用
+    if cached and not is_well_formed(cached.get("task_content"), cached.get("ai_content")):
+        cached = None
+    if content_cache:
+        metrics.record_cache_lookup("content", cached is not None)
+    if cached and quality_gate is None:
+        return cached["task_content"], cached["ai_content"]
+
+    # 获取补充信息，如果不存在则使用空字符串
+    additional_info = row.get("补充信息", "")
+    student_name = row["学生姓名"]
+    changed = not cached
+    regenerations = 0
+
+    if cached:
+        formatted_task_content, ai_content = cached["task_content"], cached["ai_content"]
+    else:
+        formatted_task_content = generate_task_content(row, start_date, end_date, additional_info, profile, usage_log)
+        ai_content = None
+        if not formatted_task_content:
             return None, None
-            
-        # 将列表转换为多行文本
-        formatted_task_content = {}
-        for key in task_content:
-            if isinstance(task_content[key], list):
-                formatted_task_content[key] = '\n'.join(task_content[key])
-            else:
-                formatted_task_content[key] = task_content[key]
-            
-        # 生成咨询记录内容
-        task_description = "\n".join([formatted_task_content[key] for key in formatted_task_content])
+
+    # 任务书缺少字段时重新生成任务书（咨询内容依赖任务书，也需一并重新生成）
+    task_issues = quality_gate.check_task(formatted_task_content) if quality_gate else []
+    initial_issues = list(task_issues)
+    for _ in range(MAX_REGENERATION_ROUNDS):
+        if not task_issues:
+            break
+        formatted_task_content = generate_task_content(row, start_date, end_date, additional_info, profile, usage_log) or formatted_task_content
+        ai_content = None
+        changed = True
+        regenerations += 1
+        metrics.QUALITY_REGENERATIONS.inc(item="task")
+        task_issues = quality_gate.check_task(formatted_task_content)
+        
+    # 生成咨询记录内容
+    task_description = build_task_description(formatted_task_content, profile)
+    if ai_content is None:
         ai_content = generate_all_ai_content(
             task_description,
             start_date,
             end_date,
             row["论文题目"],
-            row["学生姓名"],
-            additional_info
+            student_name,
+            additional_info,
+            profile,
+            usage_log
         )
-        
-        # 生成任务书文档
-        task_doc = DocxTemplate("thesis_task_description_template.docx")
-        teacher_signature = InlineImage(task_doc, teacher_signature_file, width=Mm(20))
-        dean_signature = InlineImage(task_doc, dean_signature_file, width=Mm(20))
-        
-        task_context = {
-            'title': row["论文题目"],
-            'student_name': row["学生姓名"],
-            'student_id': row["学生学号"],
-            'teacher_name': row["指导教师"],
-            'teacher_signature': teacher_signature,
-            'dean_signature': dean_signature,
-            'major': row["专业"],
-            'college': row["学院"],
-            'start_date': start_date.strftime("%Y-%m-%d"),
-            'end_date': end_date.strftime("%Y-%m-%d"),
-            **formatted_task_content
-        }
-        
-        # 如果有学生签名，添加到上下文中
-        if student_signature_path:
-            task_context['student_signature'] = InlineImage(task_doc, student_signature_path, width=Mm(20))
-        
-        task_doc.render(task_context)
-        
-        # 生成记录本文档
-        record_doc = DocxTemplate("student_consultation_template.docx")
-        teacher_signature = InlineImage(record_doc, teacher_signature_file, width=Mm(20))
-        
-        mid_date = start_date + (end_date - start_date) / 2
-        
-        # 准备咨询记录数据
-        consultations = []
-        for i, consultation in enumerate(ai_content['consultations']):
-            consultation_data = {
-                'id': i + 1,
-                'time': consultation['date'],
-                'location': '办公',
-                'student_info': consultation['student_info'],
-                'teacher_info': consultation['teacher_info']
-            }
-            consultations.append(consultation_data)
-        
-        record_context = {
-            'title': row["论文题目"],
-            'student_name': row["学生姓名"],
-            'student_id': row["学生学号"],
-            'teacher_name': row["指导教师"],
-            'teacher_signature': teacher_signature,
-            'major': row["专业"],
-            'college': row["学院"],
-            'start_date': start_date.strftime("%Y-%m-%d"),
-            'mid_date': mid_date.strftime("%Y-%m-%d"),
-            'end_date': end_date.strftime("%Y-%m-%d"),
-            'consultations': consultations,
-            'work_summary': ai_content['work_summary'],
-            'mid_term_review': ai_content['mid_term_review'],
-            'pagebreak': RichText('\f')
+
+    if quality_gate:
+        issues = quality_gate.check_ai_content(student_name, ai_content, start_date, end_date)
+        initial_issues += issues
+        for _ in range(MAX_REGENERATION_ROUNDS):
+            if not issues:
+                break
+            if any(issue["item"] == "ai_content" for issue in issues):
+                metrics.QUALITY_REGENERATIONS.inc(item="ai_content")
+                ai_content = generate_all_ai_content(
+                    task_description, start_date, end_date, row["论文题目"], student_name, additional_info, profile, usage_log
+                )
+            else:
+                metrics.QUALITY_REGENERATIONS.inc(item="consultation")
+                ai_content = regenerate_ai_items(
+                    task_description, start_date, end_date, row["论文题目"], ai_content, issues, additional_info, profile, usage_log
+                )
+            changed = True
+            regenerations += 1
+            issues = quality_gate.check_ai_content(student_name, ai_content, start_date, end_date)
+        quality_gate.accept(student_name, ai_content)
+        quality_gate.record(student_name, initial_issues, regenerations, task_issues + issues)
+
+    # 只缓存结构完整的内容（未开启质量检查时也不缓存无法渲染的结果）
+    if content_cache and changed and is_well_formed(formatted_task_content, ai_content):
+        content_cache.save(cache_key, {"task_content": formatted_task_content, "ai_content": ai_content})
+
+    return formatted_task_content, ai_content
+
+def student_dates(row):
+    """转换日期格式"""
+    return pd.to_datetime(row["开始日期"]).date(), pd.to_datetime(row["结束日期"]).date()
+
+def find_student_signature(row, signatures_dir):
+    """获取学生签名图片路径（如果有）"""
+    if signatures_dir:
+        for ext in ['.jpg', '.jpeg', '.png']:
+            path = os.path.join(signatures_dir, f"{row['学生姓名']}{ext}")
+            if os.path.exists(path):
+                return path
+    return None
+
+def generate_content_for_student(row, profile=None, content_cache=None, quality_gate=None, usage_log=None):
+    """在线程池中为单个学生生成内容，返回 ((formatted_task_content, ai_content), error)
+
+    工作线程无法向页面输出，出错时把异常返回给主线程显示。
+    """
+    with metrics.BATCH_IN_PROGRESS.track():
+        try:
+            start_date, end_date = student_dates(row)
+            content = generate_student_content(row, start_date, end_date, profile, content_cache, quality_gate, usage_log)
+        except Exception as e:
+            metrics.BATCH_STUDENTS.inc(result="error")
+            return (None, None), e
+    metrics.BATCH_STUDENTS.inc(result="ok")
+    return content, None
+
+def generate_contents(rows, concurrency, profile=None, content_cache=None, quality_gate=None, usage_log=None, memory_limit_mb=None, requests_per_minute=None):
+    """在线程池中并行生成内容，按完成顺序逐个返回 (row, (formatted_task_content, ai_content), error)
+
+    rows 可以是逐行读取的生成器：同时提交的任务不超过并发数的两倍，
+    已返回的结果不再保留；内存超过上限时暂停提交，直到在途任务完成。
+    requests_per_minute 为本批次的每分钟请求数，在服务商上限之外额外限制，不影响其他批次。
+    """
+    rows = iter(rows)
+    pending = {}
+    exhausted = False
+    batch_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+    with ThreadPoolExecutor(max_workers=concurrency, initializer=use_batch_rate_limit, initargs=(batch_limiter,)) as pool:
+        try:
+            while True:
+                while not exhausted and len(pending) < concurrency * 2 and not (pending and over_memory_limit(memory_limit_mb)):
+                    row = next(rows, None)
+                    if row is None:
+                        exhausted = True
+                        break
+                    pending[pool.submit(generate_content_for_student, row, profile, content_cache, quality_gate, usage_log)] = row
+                metrics.BATCH_QUEUE_DEPTH.set(len(pending))
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    row = pending.pop(future)
+                    content, error = future.result()
+                    yield row, content, error
+        finally:
+            metrics.BATCH_QUEUE_DEPTH.set(0)
+
+def replay_contents(records):
+    """直接使用导出的生成内容，不调用大模型（records 可以是逐行读取的生成器）"""
+    for record in records:
+        yield record["row"], (record["task_content"], record["ai_content"]), None
+
+def render_student_documents(row, formatted_task_content, ai_content, teacher_signature_file, dean_signature_file, signatures_dir=None, document_cache=None):
+    """为单个学生渲染文档，返回任务书和记录本在文档缓存中的路径"""
+    if document_cache is None:
+        document_cache = DocumentCache()
+
+    start_date, end_date = student_dates(row)
+    student_signature_path = find_student_signature(row, signatures_dir)
+
+    # 生成任务书文档
+    task_context = {
+        'title': row["论文题目"],
+        'student_name': row["学生姓名"],
+        'student_id': row["学生学号"],
+        'teacher_name': row["指导教师"],
+        'major': row["专业"],
+        'college': row["学院"],
+        'start_date': start_date.strftime("%Y-%m-%d"),
+        'end_date': end_date.strftime("%Y-%m-%d"),
+        **formatted_task_content
+    }
+    task_images = {
+        'teacher_signature': teacher_signature_file,
+        'dean_signature': dean_signature_file
+    }
+    
+    # 如果有学生签名，添加到上下文中
+    if student_signature_path:
+        task_images['student_signature'] = student_signature_path
+    
+    task_path = render_document(TASK_TEMPLATE, task_context, task_images, document_cache)
+    
+    # 生成记录本文档
+    mid_date = start_date + (end_date - start_date) / 2
+    
+    # 准备咨询记录数据
+    consultations = []
+    for i, consultation in enumerate(ai_content['consultations']):
+        consultation_data = {
+            'id': i + 1,
+            'time': consultation['date'],
+            'location': '办公',
+            'student_info': consultation['student_info'],
+            'teacher_info': consultation['teacher_info']
         }
-        
-        # 如果有学生签名，添加到上下文中
-        if student_signature_path:
-            record_context['student_signature'] = InlineImage(record_doc, student_signature_path, width=Mm(20))
-        
-        record_doc.render(record_context)
-        
-        return task_doc, record_doc
-        
-    except Exception as e:
-        st.error(f"生成文档时出错：{str(e)}")
-        st.exception(e)  # 显示详细的错误信息
-        return None, None
+        consultations.append(consultation_data)
+    
+    record_context = {
+        'title': row["论文题目"],
+        'student_name': row["学生姓名"],
+        'student_id': row["学生学号"],
+        'teacher_name': row["指导教师"],
+        'major': row["专业"],
+        'college': row["学院"],
+        'start_date': start_date.strftime("%Y-%m-%d"),
+        'mid_date': mid_date.strftime("%Y-%m-%d"),
+        'end_date': end_date.strftime("%Y-%m-%d"),
+        'consultations': consultations,
+        'work_summary': ai_content['work_summary'],
+        'mid_term_review': ai_content['mid_term_review']
+    }
+    record_images = {'teacher_signature': teacher_signature_file}
+    
+    # 如果有学生签名，添加到上下文中
+    if student_signature_path:
+        record_images['student_signature'] = student_signature_path
+    
+    record_path = render_document(RECORD_TEMPLATE, record_context, record_images, document_cache)
+    
+    return task_path, record_path
+
+def submit_pdf(converter, docx_path):
+    """提交PDF转换，已转换过的文档直接复用缓存中的PDF，返回 (pdf_path, future)"""
+    pdf_path = os.path.splitext(docx_path)[0] + ".pdf"
+    if is_complete_pdf(pdf_path):
+        mark_used(pdf_path)
+        return pdf_path, None
+    return pdf_path, converter.submit(docx_path, pdf_path)
+
+def collect_pdfs(zf, pdf_jobs):
+    """等待PDF转换完成并写入ZIP，返回每个文件的转换耗时报告"""
+    report = []
+    for arcname, pdf_path, future in pdf_jobs:
+        if future is None:
+            zf.write(pdf_path, arcname)
+            report.append({"文件": arcname, "转换耗时（秒）": 0.0, "状态": "缓存"})
+            continue
+        try:
+            pdf_path, elapsed = future.result()
+            zf.write(pdf_path, arcname)
+            report.append({"文件": arcname, "转换耗时（秒）": round(elapsed, 2), "状态": "已转换"})
+        except Exception as e:
+            report.append({"文件": arcname, "转换耗时（秒）": None, "状态": f"失败：{str(e)}"})
+    return report
+
+def merge_group_name(row):
+    """合并文档的分组名称：有“班级”列时按班级分组，否则全部学生合并为一组"""
+    group = row.get("班级", "")
+    if pd.isna(group) or not str(group).strip():
+        return "全体学生"
+    return str(group).strip()
+
+def build_archive(results, zip_path, teacher_signature_file, dean_signature_file, signatures_dir=None, document_cache=None,
+                  formats=("docx",), converter=None, merge_dir=None, merge_chunk_size=0, quality_gate=None,
+                  on_progress=None, on_error=None):
+    """渲染每个学生的文档并写入磁盘上的ZIP文件，返回渲染耗时和PDF转换报告
+
+    results 为按顺序产生 (row, (formatted_task_content, ai_content), error) 的生成器；
+    每个学生的文档渲染到文档缓存后立即写入ZIP，内存中不保留已处理学生的内容。
+    """
+    if document_cache is None:
+        document_cache = DocumentCache()
+    on_progress = on_progress or (lambda done, row: None)
+    on_error = on_error or (lambda row, message, error: None)
+    render_seconds = 0.0
+    pdf_jobs = []
+    mergers = {}
+
+    with zipfile.ZipFile(zip_path, "w") as zf, \
+            tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".jsonl") as replay_output:
+        # 生成内容先写入临时文件，最后作为一个文件打包，便于以后不调用大模型重新渲染
+        for done, (row, (formatted_task_content, ai_content), error) in enumerate(results, 1):
+            on_progress(done, row)
+            if error:
+                on_error(row, f"生成 {row['学生姓名']} 的内容时出错：{str(error)}", None)
+                continue
+            if not formatted_task_content:
+                continue
+            replay_output.write(replay_line(row, formatted_task_content, ai_content))
+
+            try:
+                render_started = time.perf_counter()
+                task_path, record_path = render_student_documents(
+                    row,
+                    formatted_task_content,
+                    ai_content,
+                    teacher_signature_file,
+                    dean_signature_file,
+                    signatures_dir,
+                    document_cache
+                )
+                render_seconds += time.perf_counter() - render_started
+            except Exception as e:
+                on_error(row, f"生成 {row['学生姓名']} 的文档时出错：{str(e)}", e)
+                continue
+
+            if done % RELEASE_MEMORY_INTERVAL == 0:
+                release_memory()
+
+            for doc_name, docx_path in (("任务书", task_path), ("记录本", record_path)):
+                arcname = f"{row['学生姓名']} - {doc_name}"
+                # 从文档缓存复制Word文档
+                if "docx" in formats:
+                    zf.write(docx_path, f"{arcname}.docx")
+                # 转换在后台进行，渲染下一个学生时不必等待
+                if converter:
+                    pdf_path, pdf_future = submit_pdf(converter, docx_path)
+                    pdf_jobs.append((f"{arcname}.pdf", pdf_path, pdf_future))
+                # 追加到所在班级的合并文档
+                if merge_dir:
+                    merger_name = f"{merge_group_name(row)} - {doc_name}合并"
+                    if merger_name not in mergers:
+                        mergers[merger_name] = CohortMerger(merger_name, merge_dir, merge_chunk_size)
+                    mergers[merger_name].add(docx_path)
+
+        replay_output.flush()
+        zf.write(replay_output.name, REPLAY_FILENAME)
+
+        if quality_gate and quality_gate.report:
+            zf.writestr("质量检查报告.csv", pd.DataFrame(quality_gate.report).to_csv(index=False).encode("utf-8-sig"))
+
+        for merger in mergers.values():
+            for merged_path in merger.close():
+                zf.write(merged_path, f"合并文档/{os.path.basename(merged_path)}")
+
+        conversion_report = collect_pdfs(zf, pdf_jobs) if pdf_jobs else []
+
+    return render_seconds, conversion_report
+
+def publish_archive(zip_path, previous_path=None):
+    """把ZIP移到下载目录（临时目录删除后仍可下载），删除上一次生成的ZIP，返回新路径"""
+    # 清理时可能删除空的下载目录，之后再创建
+    prune_cache(DOWNLOAD_DIR, 0, DOWNLOAD_MAX_AGE_DAYS)
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    if previous_path:
+        with contextlib.suppress(OSError):
+            os.remove(previous_path)
+    path = os.path.join(DOWNLOAD_DIR, f"{uuid.uuid4().hex}.zip")
+    shutil.move(zip_path, path)
+    return path
+
+def read_archive(path):
+    """返回下载时才读取ZIP的函数：页面上只登记下载按钮，ZIP不会一直保存在会话的内存中"""
+    def read():
+        with open(path, "rb") as f:
+            return f.read()
+    return read
+
+def show_plan(plan):
+    """显示批次估算结果"""
+    col1, col2, col3 = st.columns(3)
+    col1.metric("需要调用大模型的学生", f"{plan['llm_students']} / {plan['students']}")
+    col2.metric("预计输入token", f"{plan['prompt_tokens']:,}")
+    col3.metric("预计输出token", f"{plan['completion_tokens']:,}")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("预计调用次数", f"{plan['calls']:.0f}")
+    col2.metric("预计费用", f"¥{plan['cost']:.2f}")
+    col3.metric("预计耗时", f"{plan['seconds'] / 60:.1f} 分钟")
+    st.caption("估算基于实际构造的提示词和历史运行数据，每次批量生成后会自动校准。")
 
 def get_excel_download_link():
     """生成Excel模板文件的下载链接"""
@@ -212,6 +621,7 @@ def get_excel_download_link():
     return href
 
 def main():
+    metrics.start_exporter()
     st.title("批量生成毕业论文归档材料")
     
     # 添加使用说明
@@ -226,6 +636,7 @@ def main():
            - 按模板格式填写学生信息
            - 必须包含以下列：论文题目、学生姓名、学生学号、指导教师、专业、学院、开始日期、结束日期
            - 日期格式为：YYYY-MM-DD（如：2024-03-01）
+           - 可选列：班级（生成合并文档时按班级分别合并）
         
         2. **准备签名图片**
            - 教师签名：单个图片文件（必需，支持jpg、jpeg、png格式）
@@ -258,6 +669,11 @@ def main():
         程序将生成一个ZIP文件，包含：
         1. 每个学生的任务书（包含任务内容、进度安排等）
         2. 每个学生的记录本（包含16次咨询记录、中期检查评价和工作总结）
+        
+        输出格式可选择 Word、PDF 或两者都要，导出PDF需要服务器上安装 LibreOffice。
+        
+        ZIP中还包含“生成内容.jsonl”，保存了每个学生的信息和AI生成的内容。模板更新后，
+        上传该文件即可直接重新渲染所有文档，不需要再次调用大模型。
         """)
     
     # 上传文件
@@ -265,62 +681,228 @@ def main():
     teacher_signature_file = st.file_uploader("上传教师签名图片（必需）", type=["png", "jpg", "jpeg"])
     dean_signature_file = st.file_uploader("上传系主任签名图片（必需）", type=["png", "jpg", "jpeg"])
     signatures_zip = st.file_uploader("上传学生签名ZIP文件（可选）", type="zip")
+    replay_file = st.file_uploader(
+        "上传之前导出的生成内容（可选）",
+        type="jsonl",
+        help=f"上传之前批量生成时ZIP中的“{REPLAY_FILENAME}”，将直接使用其中的学生信息和生成内容重新渲染文档，不调用大模型，也不需要上传Excel文件。"
+    )
+    profile = st.selectbox(
+        "生成配置",
+        list(GENERATION_PROFILES),
+        index=list(GENERATION_PROFILES).index(DEFAULT_PROFILE),
+        help="“精简”配置要求的条目数和字数更少，并只将任务书的任务内容和技术要求作为咨询内容的生成依据，生成速度更快。"
+    )
+    reuse_content = st.checkbox(
+        "复用已生成的AI内容",
+        value=True,
+        help="学生信息和生成配置未变化时直接使用上次生成的内容，不再调用大模型。取消勾选将重新生成。"
+    )
+    check_quality = st.checkbox(
+        "生成后进行质量检查",
+        value=True,
+        help="在渲染前检查字数、日期、任务书字段和重复内容，只对未通过检查的部分重新生成，并在ZIP中附带质量检查报告。"
+    )
+    if st.button("清除缓存"):
+        clear_cache()
+        st.success("缓存已清除。")
+
+    output_format = st.radio("输出格式", list(OUTPUT_FORMATS), horizontal=True)
+    formats = OUTPUT_FORMATS[output_format]
+    converter_count = 1
+    if "pdf" in formats:
+        if find_converter():
+            converter_count = st.slider("PDF转换进程数", min_value=1, max_value=4, value=2)
+        else:
+            st.error("未找到 LibreOffice（soffice），无法导出PDF，请安装后重试或选择 Word 格式。")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        concurrency = st.slider(
+            "同时处理的学生数",
+            min_value=1,
+            max_value=32,
+            value=16 if concurrency_limiter.enabled else 4,
+            help="本批次同时生成内容的学生数量。"
+        )
+        if concurrency_limiter.enabled:
+            st.caption(
+                f"调用大模型的并发数根据响应情况自动调整（所有会话共用，上限 {concurrency_limiter.max_limit}），"
+                "遇到限流（429）、超时或响应明显变慢时减半。"
+            )
+    with col2:
+        provider_rate = rate_limiter.requests_per_minute
+        requests_per_minute = st.number_input(
+            "本批次每分钟最多请求数（0表示不额外限制）",
+            min_value=0,
+            value=0,
+            step=10,
+            help="只能在部署配置的上限（DEEPSEEK_REQUESTS_PER_MINUTE）之内进一步限制本批次，不影响其他会话。"
+        )
+        if provider_rate:
+            st.caption(f"部署配置的上限：每分钟 {provider_rate} 次（所有会话共用）。")
+    # 估算时按两者中较严格的限制计算
+    effective_rate = min(filter(None, (provider_rate, requests_per_minute)), default=None)
+    # 自动调整时同时进行的调用数受共用的并发控制限制，估算时从其当前并发数开始逐步增加
+    if concurrency_limiter.enabled:
+        planned_concurrency = min(concurrency, concurrency_limiter.max_limit)
+        initial_concurrency = min(concurrency_limiter.current_limit, planned_concurrency)
+    else:
+        planned_concurrency, initial_concurrency = concurrency, None
+
+    memory_limit_mb = st.number_input(
+        "内存上限（MB，0表示不限制）",
+        min_value=0,
+        value=1024,
+        step=256,
+        help="内存占用超过上限时暂停提交新的学生，等待正在处理的学生完成后再继续。"
+    )
+
+    merge_documents = st.checkbox(
+        "额外生成合并文档（便于打印）",
+        help="将所有学生的记录本合并为一个Word文档、任务书合并为另一个，每个学生从新的一页开始。Excel中有“班级”列时按班级分别合并。"
+    )
+    merge_chunk_size = 0
+    if merge_documents and st.checkbox(
+        "合并文档按学生数分册",
+        help="默认每个班级只生成一个合并文档；班级人数很多时可分成多册，减少合并时的内存占用。"
+    ):
+        merge_chunk_size = st.number_input("每册最多包含的学生数", min_value=10, max_value=500, value=50, step=10)
     
-    if excel_file and teacher_signature_file and dean_signature_file:
-        # 解压签名文件到临时目录（如果有）
-        signatures_dir = None
-        if signatures_zip:
-            signatures_dir = extract_signatures(signatures_zip)
-            
-        df = process_excel_file(excel_file)
+    if (excel_file or replay_file) and teacher_signature_file and dean_signature_file:
+        # 只读取前几行用于预览，处理时再逐行读取
+        if replay_file:
+            try:
+                total = count_uploaded_rows(replay_file, count_replay_records)
+                df = pd.DataFrame([record["row"] for record in itertools.islice(iter_replay_file(replay_file), PREVIEW_ROWS)])
+                st.info(f"将使用导出的生成内容重新渲染 {total} 个学生的文档，不调用大模型。")
+            except Exception as e:
+                st.error(f"读取生成内容文件时出错：{str(e)}")
+                df = None
+        else:
+            df = process_excel_file(excel_file, PREVIEW_ROWS)
+            total = count_uploaded_rows(excel_file, count_sheet_rows) if df is not None else 0
         
         if df is not None:
-            st.write("已读取的学生信息：")
+            st.write(f"已读取的学生信息（共 {total} 人）：")
             st.dataframe(df)
+            if total > PREVIEW_ROWS:
+                st.caption(f"仅预览前 {PREVIEW_ROWS} 行。")
             
-            if st.button("开始批量生成文档"):
-                # 创建ZIP文件
-                zip_buffer = io.BytesIO()
-                
-                with zipfile.ZipFile(zip_buffer, "w") as zf:
-                    for index, row in df.iterrows():
-                        with st.spinner(f"正在处理 {row['学生姓名']} 的文档..."):
-                            task_doc, record_doc = generate_documents_for_student(
-                                row, 
-                                teacher_signature_file,
-                                dean_signature_file,
-                                signatures_dir
-                            )
-                            
-                            if task_doc and record_doc:
-                                # 保存任务书
-                                task_buffer = io.BytesIO()
-                                task_doc.save(task_buffer)
-                                zf.writestr(
-                                    f"{row['学生姓名']} - 任务书.docx",
-                                    task_buffer.getvalue()
-                                )
-                                
-                                # 保存记录本
-                                record_buffer = io.BytesIO()
-                                record_doc.save(record_buffer)
-                                zf.writestr(
-                                    f"{row['学生姓名']} - 记录本.docx",
-                                    record_buffer.getvalue()
-                                )
+            if not replay_file:
+                with st.expander("运行前估算（不调用大模型）"):
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        price_input = st.number_input("输入价格（元/百万token）", min_value=0.0, value=2.0)
+                    with col2:
+                        price_output = st.number_input("输出价格（元/百万token）", min_value=0.0, value=8.0)
+                    if st.button("估算耗时和费用"):
+                        estimate_cache = ContentCache() if reuse_content else None
+                        plan = plan_batch(
+                            iter_sheet_rows(excel_file),
+                            profile,
+                            planned_concurrency,
+                            effective_rate,
+                            price_input,
+                            price_output,
+                            is_cached=lambda row: estimate_cache is not None and estimate_cache.contains(content_key(row, profile)),
+                            quality_check=check_quality,
+                            initial_concurrency=initial_concurrency
+                        )
+                        show_plan(plan)
+
+            if st.button("开始批量生成文档", disabled="pdf" in formats and not find_converter()):
+                document_cache = DocumentCache()
+                content_cache = ContentCache() if reuse_content else None
+                quality_gate = QualityGate() if check_quality and not replay_file else None
+                usage_log = []
+                plan = None
+                if replay_file:
+                    results = replay_contents(iter_replay_file(replay_file))
+                else:
+                    plan = plan_batch(
+                        iter_sheet_rows(excel_file), profile, planned_concurrency, effective_rate,
+                        is_cached=lambda row: content_cache is not None and content_cache.contains(content_key(row, profile)),
+                        quality_check=check_quality,
+                        initial_concurrency=initial_concurrency
+                    )
+                    results = generate_contents(
+                        iter_sheet_rows(excel_file), concurrency, profile, content_cache, quality_gate, usage_log, memory_limit_mb,
+                        requests_per_minute
+                    )
+                started = time.perf_counter()
+                progress = st.progress(0.0, text="正在生成文档...")
+
+                def show_progress(done, row):
+                    status = f"内存 {current_rss_mb():.0f} MB"
+                    if concurrency_limiter.enabled and not replay_file:
+                        status += f"，当前并发 {concurrency_limiter.current_limit}/{concurrency_limiter.max_limit}"
+                    progress.progress(min(done / max(total, 1), 1.0), text=f"已完成 {done}/{total}：{row['学生姓名']}（{status}）")
+
+                def show_error(row, message, error):
+                    st.error(message)
+                    if error:
+                        st.exception(error)  # 显示详细的错误信息
+
+                # 临时文件和目录在退出时（包括出错时）统一清理
+                with contextlib.ExitStack() as stack:
+                    work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+                    signatures_dir = stack.enter_context(extract_signatures(signatures_zip)) if signatures_zip else None
+                    converter = stack.enter_context(PdfConverter(converter_count)) if "pdf" in formats else None
+                    merge_dir = os.path.join(work_dir, "merged") if merge_documents else None
+                    if merge_dir:
+                        os.makedirs(merge_dir)
+                    zip_path = os.path.join(work_dir, "archive.zip")
+
+                    render_seconds, conversion_report = build_archive(
+                        results,
+                        zip_path,
+                        teacher_signature_file,
+                        dean_signature_file,
+                        signatures_dir,
+                        document_cache,
+                        formats,
+                        converter,
+                        merge_dir,
+                        merge_chunk_size,
+                        quality_gate,
+                        show_progress,
+                        show_error
+                    )
                 
-                # 提供ZIP文件下载
-                zip_buffer.seek(0)
-                b64 = base64.b64encode(zip_buffer.getvalue()).decode()
-                href = f'<a href="data:application/zip;base64,{b64}" download="毕业论文归档材料.zip">下载所有生成的文档</a>'
-                st.markdown(href, unsafe_allow_html=True)
+                    st.info(f"文档缓存命中 {document_cache.hits} 个，新渲染 {document_cache.misses} 个。")
+                    # 缓存超过大小上限或保留天数时清理最久未使用的文件
+                    removed, freed = prune_cache()
+                    if removed:
+                        st.caption(f"已清理 {removed} 个旧缓存文件，释放 {freed / 1024 / 1024:.0f} MB。")
+                    if plan:
+                        actual = calibrate(plan, usage_log, render_seconds)
+                        st.info(
+                            f"实际调用大模型 {actual['calls']} 次（预计 {plan['calls']:.0f} 次），"
+                            f"输入 {actual['prompt_tokens']} token（预计 {plan['prompt_tokens']}），"
+                            f"输出 {actual['completion_tokens']} token（预计 {plan['completion_tokens']}），"
+                            f"耗时 {time.perf_counter() - started:.0f} 秒（预计 {plan['seconds']:.0f} 秒）。"
+                        )
+                    else:
+                        st.info(f"已从导出的生成内容重新渲染，耗时 {time.perf_counter() - started:.1f} 秒。")
+                    if quality_gate and quality_gate.report:
+                        st.write("质量检查报告：")
+                        st.dataframe(pd.DataFrame(quality_gate.report))
+                    if conversion_report:
+                        st.write("PDF转换耗时：")
+                        st.dataframe(pd.DataFrame(conversion_report))
+                    
+                    # 提供ZIP文件下载：点击时才从磁盘读取，不在会话中保留整个ZIP
+                    archive_path = publish_archive(zip_path, st.session_state.get("archive_path"))
+                    st.session_state["archive_path"] = archive_path
+                    st.download_button(
+                        "下载所有生成的文档",
+                        data=read_archive(archive_path),
+                        file_name="毕业论文归档材料.zip",
+                        mime="application/zip",
+                        on_click="ignore"
+                    )
                 
                 st.success("所有文档已生成完成！")
-                
-                # 清理临时目录
-                if signatures_dir:
-                    import shutil
-                    shutil.rmtree(signatures_dir)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,227 @@
+"""批量生成前估算token用量、费用和耗时，并在运行后用实际用量校准"""
+import contextlib
+import json
+import os
+import re
+import threading
+import pandas as pd
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from generation_profiles import (
+    build_task_messages,
+    build_consultation_messages,
+    get_generation_profile,
+    DIGEST_KEYS,
+    TASK_PARTS
+)
+from document_cache import atomic_write
+
+# 历史统计数据保存位置（不放在缓存目录中，清除缓存时不会丢失）
+STATS_PATH = os.environ.get("THESIS_STATS_PATH", ".thesis_stats.json")
+
+# DeepSeek 的估算方法：1个中文字符约0.6个token，1个英文字符约0.3个token
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+MESSAGE_OVERHEAD_TOKENS = 4
+_CJK = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+# 没有历史数据时使用的默认值
+DEFAULT_STAGE_STATS = {
+    "generate_task_description": {"completion_tokens": 1500, "seconds_per_token": 0.04, "prompt_ratio": 1.0},
+    "generate_all_ai_content": {"completion_tokens": 5000, "seconds_per_token": 0.04, "prompt_ratio": 1.0},
+    "regenerate_ai_items": {"completion_tokens": 800, "seconds_per_token": 0.04, "prompt_ratio": 1.0}
+}
+DEFAULT_STATS = {
+    "stages": {},
+    # 每个学生平均额外调用次数（质量检查未通过时的重新生成）
+    "extra_calls_per_student": 0.2,
+    # 每个学生渲染文档的耗时（秒）
+    "render_seconds": 1.0
+}
+# 每次调用除生成token外的固定耗时（秒）
+CALL_OVERHEAD_SECONDS = 2.0
+# 历史数据的指数平滑权重
+EMA_WEIGHT = 0.3
+
+def estimate_tokens(text):
+    """按字符类型近似估算token数"""
+    text = text or ""
+    cjk = len(_CJK.findall(text))
+    return int(cjk * CJK_TOKENS_PER_CHAR + (len(text) - cjk) * OTHER_TOKENS_PER_CHAR) + 1
+
+def estimate_message_tokens(messages):
+    return sum(estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+def load_stats(path=STATS_PATH):
+    """读取历史统计数据"""
+    stats = json.loads(json.dumps(DEFAULT_STATS))
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            stats.update(json.load(f))
+    return stats
+
+def save_stats(stats, path=STATS_PATH):
+    atomic_write(os.path.abspath(path), json.dumps(stats, ensure_ascii=False, indent=2).encode("utf-8"))
+
+_stats_lock = threading.Lock()
+
+@contextlib.contextmanager
+def locked_stats(path=STATS_PATH):
+    """读取历史统计数据，退出时保存；期间持有文件锁，多个会话或进程同时校准时不会互相覆盖"""
+    with _stats_lock, open(os.path.abspath(path) + ".lock", "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        stats = load_stats(path)
+        yield stats
+        save_stats(stats, path)
+
+def stage_stats(stats, stage):
+    return {**DEFAULT_STAGE_STATS[stage], **stats["stages"].get(stage, {})}
+
+def _expected_completion(stats, stage, stage_config):
+    completion = stage_stats(stats, stage)["completion_tokens"]
+    if stage_config.get("max_tokens"):
+        completion = min(completion, stage_config["max_tokens"])
+    return completion
+
+def _call_seconds(stats, stage, completion_tokens):
+    return CALL_OVERHEAD_SECONDS + completion_tokens * stage_stats(stats, stage)["seconds_per_token"]
+
+def _llm_seconds(calls, call_seconds, concurrency, initial_concurrency=None):
+    """按并发数估算完成 calls 次调用的耗时
+
+    initial_concurrency 小于 concurrency 时按自动调整的方式估算：从初始并发数开始，
+    每完成一轮调用（约一次调用的耗时）并发数加一，直到达到上限。
+    """
+    concurrency = max(concurrency, 1)
+    limit = max(min(initial_concurrency or concurrency, concurrency), 1)
+    seconds = 0.0
+    while calls > 0 and limit < concurrency:
+        seconds += call_seconds
+        calls -= limit
+        limit += 1
+    return seconds + max(calls, 0) * call_seconds / concurrency
+
+def plan_batch(rows, profile=None, concurrency=1, requests_per_minute=None, price_input=0.0, price_output=0.0, is_cached=None, stats=None, quality_check=True, initial_concurrency=None):
+    """根据实际构造的提示词估算一个批次的token用量、费用和耗时
+
+    rows 为学生信息（每行一个 dict 或 Series），is_cached(row) 为真的学生直接复用已生成的内容，
+    不计入大模型调用。价格单位为元/百万token。不做质量检查时没有重新生成的调用。
+    concurrency 为同时进行的调用数，并发数自动调整时 initial_concurrency 为开始时的并发数。
+    """
+    stats = stats or load_stats()
+    extra_calls_per_student = stats["extra_calls_per_student"] if quality_check else 0.0
+    generation_profile = get_generation_profile(profile)
+    task_stage, consultation_stage = "generate_task_description", "generate_all_ai_content"
+
+    # 任务书描述作为咨询内容的输入，按生成配置估算其长度
+    description_fraction = len(DIGEST_KEYS) / len(TASK_PARTS) if generation_profile["use_digest"] else 1.0
+    task_completion = _expected_completion(stats, task_stage, generation_profile["task"])
+    consultation_completion = _expected_completion(stats, consultation_stage, generation_profile["consultation"])
+    regeneration_completion = _expected_completion(stats, "regenerate_ai_items", generation_profile["consultation"])
+
+    students = 0
+    llm_students = 0
+    raw_prompt_tokens = {task_stage: 0, consultation_stage: 0}
+    for row in rows:
+        students += 1
+        if is_cached and is_cached(row):
+            continue
+        llm_students += 1
+        start_date = pd.to_datetime(row["开始日期"]).date()
+        end_date = pd.to_datetime(row["结束日期"]).date()
+        additional_info = row.get("补充信息", "")
+        raw_prompt_tokens[task_stage] += estimate_message_tokens(
+            build_task_messages(row["论文题目"], row["专业"], start_date, end_date, additional_info, profile)
+        )
+        raw_prompt_tokens[consultation_stage] += estimate_message_tokens(
+            build_consultation_messages("", start_date, end_date, row["论文题目"], additional_info, profile)
+        ) + int(task_completion * description_fraction)
+
+    prompt_tokens = sum(
+        tokens * stage_stats(stats, stage)["prompt_ratio"] for stage, tokens in raw_prompt_tokens.items()
+    )
+    extra_calls = llm_students * extra_calls_per_student
+    if llm_students:
+        # 重新生成的提示词与咨询内容的提示词规模相当
+        prompt_tokens += extra_calls * raw_prompt_tokens[consultation_stage] / llm_students
+    completion_tokens = llm_students * (task_completion + consultation_completion) + extra_calls * regeneration_completion
+
+    # 每个学生的调用是串行的，不同学生之间按并发数并行，同时受每分钟请求数限制
+    student_seconds = (
+        _call_seconds(stats, task_stage, task_completion)
+        + _call_seconds(stats, consultation_stage, consultation_completion)
+        + extra_calls_per_student * _call_seconds(stats, "regenerate_ai_items", regeneration_completion)
+    )
+    calls = llm_students * 2 + extra_calls
+    llm_seconds = _llm_seconds(calls, student_seconds / (2 + extra_calls_per_student), concurrency, initial_concurrency) if calls else 0.0
+    if requests_per_minute:
+        llm_seconds = max(llm_seconds, calls * 60.0 / requests_per_minute)
+    # 文档在主线程中逐个渲染，与大模型调用同时进行
+    render_seconds = students * stats["render_seconds"]
+
+    return {
+        "students": students,
+        "llm_students": llm_students,
+        "quality_check": quality_check,
+        "calls": calls,
+        "prompt_tokens": int(prompt_tokens),
+        "completion_tokens": int(completion_tokens),
+        "raw_prompt_tokens": raw_prompt_tokens,
+        "cost": prompt_tokens / 1e6 * price_input + completion_tokens / 1e6 * price_output,
+        "seconds": max(llm_seconds, render_seconds) if llm_students else render_seconds
+    }
+
+def _ema(old, new):
+    return old * (1 - EMA_WEIGHT) + new * EMA_WEIGHT
+
+def _update_stats(stats, plan, usage_log, render_seconds):
+    llm_students = plan["llm_students"]
+
+    for stage in DEFAULT_STAGE_STATS:
+        calls = [item for item in usage_log if item["stage"] == stage]
+        if not calls:
+            continue
+        current = stage_stats(stats, stage)
+        completion = sum(item["completion_tokens"] for item in calls) / len(calls)
+        seconds_per_token = sum(
+            max(item["latency"] - CALL_OVERHEAD_SECONDS, 0.0) / max(item["completion_tokens"], 1) for item in calls
+        ) / len(calls)
+        updated = {
+            "completion_tokens": _ema(current["completion_tokens"], completion),
+            "seconds_per_token": _ema(current["seconds_per_token"], seconds_per_token),
+            "prompt_ratio": current["prompt_ratio"]
+        }
+        # 每个学生的第一次调用与估算的提示词长度对比，得到估算方法的校正系数
+        estimated = plan["raw_prompt_tokens"].get(stage)
+        if estimated and llm_students and len(calls) >= llm_students:
+            actual = sum(item["prompt_tokens"] for item in calls[:llm_students])
+            updated["prompt_ratio"] = _ema(current["prompt_ratio"], actual / estimated)
+        stats["stages"][stage] = updated
+
+    # 只用做了质量检查的批次更新重新生成的调用次数
+    if llm_students and plan.get("quality_check", True):
+        extra_calls = len(usage_log) - 2 * llm_students
+        stats["extra_calls_per_student"] = _ema(stats["extra_calls_per_student"], max(extra_calls, 0) / llm_students)
+    if render_seconds is not None and plan["students"]:
+        stats["render_seconds"] = _ema(stats["render_seconds"], render_seconds / plan["students"])
+
+def calibrate(plan, usage_log, render_seconds=None, stats=None, path=STATS_PATH):
+    """用本次运行的实际用量更新历史统计数据，返回实际用量汇总
+
+    不传 stats 时在文件锁内读取、更新并保存 path 中的统计数据，多个会话同时校准时不会丢失更新。
+    """
+    if stats is None:
+        with locked_stats(path) as stats:
+            _update_stats(stats, plan, usage_log, render_seconds)
+    else:
+        _update_stats(stats, plan, usage_log, render_seconds)
+        save_stats(stats, path)
+
+    return {
+        "calls": len(usage_log),
+        "prompt_tokens": sum(item["prompt_tokens"] for item in usage_log),
+        "completion_tokens": sum(item["completion_tokens"] for item in usage_log)
+    }
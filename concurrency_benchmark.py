@@ -0,0 +1,92 @@
+"""在本地模拟服务上对比固定并发和自动调整并发（不调用真实的大模型）
+
+用法：
+    python concurrency_benchmark.py --students 60 --max-concurrency 16 --capacity 12 6 3 --phase-seconds 10
+
+模拟服务的容量按阶段下降（见 mock_llm_server.py），分别用固定并发数和自动调整运行同一批学生，
+输出耗时、失败的学生数、429次数，以及每个容量阶段的平均并发上限。
+"""
+import argparse
+import statistics
+import threading
+import time
+from openai import OpenAI
+import metrics
+import student_consultation_app
+from student_consultation_app import concurrency_limiter, rate_limiter
+from batch_generation_app import generate_contents
+from memory_benchmark import synthetic_record
+from mock_llm_server import MockLLMServer
+
+SAMPLE_INTERVAL = 0.5
+
+def run_mode(adaptive, args):
+    """启动一个新的模拟服务并运行一批学生，返回统计结果"""
+    server = MockLLMServer(capacities=args.capacity, phase_seconds=args.phase_seconds, base_latency=args.latency).start()
+    student_consultation_app.client = OpenAI(api_key="mock", base_url=server.url, max_retries=0, timeout=args.timeout)
+    rate_limiter.set_rate(None)
+    concurrency_limiter.configure(args.initial_concurrency, args.max_concurrency, enabled=adaptive)
+
+    samples = []
+    stop = threading.Event()
+    before = {
+        reason: metrics.LLM_CONCURRENCY_DECREASES.value(reason=reason)
+        for reason in ("rate_limit", "timeout", "server_error", "latency")
+    }
+
+    def sample():
+        while not stop.wait(SAMPLE_INTERVAL):
+            limit = concurrency_limiter.current_limit if adaptive else args.max_concurrency
+            samples.append((server.capacity(), limit, concurrency_limiter.in_flight))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    rows = (synthetic_record(i)["row"] for i in range(args.students))
+    failed = sum(1 for _, _, error in generate_contents(rows, args.max_concurrency) if error)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+    server.stop()
+
+    phases = {}
+    for capacity, limit, in_flight in samples:
+        phases.setdefault(capacity, []).append((limit, in_flight))
+    return {
+        "mode": "自动调整" if adaptive else "固定并发",
+        "seconds": elapsed,
+        "failed": failed,
+        "rate_limited": server.stats["rate_limited"],
+        "decreases": {
+            reason: metrics.LLM_CONCURRENCY_DECREASES.value(reason=reason) - before.get(reason, 0)
+            for reason in ("rate_limit", "timeout", "server_error", "latency")
+        },
+        "phases": {
+            capacity: (statistics.mean(limit for limit, _ in values), statistics.mean(in_flight for _, in_flight in values))
+            for capacity, values in phases.items()
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地模拟服务上对比固定并发和自动调整并发")
+    parser.add_argument("--students", type=int, default=60)
+    parser.add_argument("--max-concurrency", type=int, default=16, help="固定并发数，也是自动调整的上限")
+    parser.add_argument("--initial-concurrency", type=int, default=2, help="自动调整的初始并发数")
+    parser.add_argument("--capacity", nargs="+", type=int, default=[12, 6, 3], help="模拟服务各阶段的容量")
+    parser.add_argument("--phase-seconds", type=float, default=10.0)
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟服务空闲时生成任务书的延迟（秒）")
+    parser.add_argument("--timeout", type=float, default=30.0, help="每次调用的超时时间（秒）")
+    args = parser.parse_args()
+
+    for adaptive in (False, True):
+        result = run_mode(adaptive, args)
+        print(
+            f"{result['mode']}：耗时 {result['seconds']:.1f} 秒，失败 {result['failed']}/{args.students} 个学生，"
+            f"429 共 {result['rate_limited']} 次，并发减半 {sum(result['decreases'].values()):.0f} 次"
+            + "".join(f"（{reason} {count:.0f}）" for reason, count in result["decreases"].items() if count)
+        )
+        for capacity, (limit, in_flight) in sorted(result["phases"].items(), reverse=True):
+            print(f"    容量 {capacity:>3}：平均并发上限 {limit:5.1f}，平均进行中的请求 {in_flight:5.1f}")
+
+if __name__ == "__main__":
+    main()
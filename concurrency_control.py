@@ -0,0 +1,135 @@
+"""根据大模型调用的延迟和错误自动调整同时进行的请求数（AIMD）"""
+import collections
+import contextlib
+import math
+import threading
+import metrics
+
+# 并发数的调整幅度：每轮成功加一，过载时减半
+INCREASE_STEP = 1
+DECREASE_FACTOR = 0.5
+# 每类调用保留最近多少次的延迟用于计算p95，样本少于下限时不判断延迟
+LATENCY_WINDOW = 20
+MIN_LATENCY_SAMPLES = 8
+# p95 超过基线的倍数时视为延迟突增
+LATENCY_SPIKE_FACTOR = 2.0
+# 基线随延迟升高而缓慢上调的权重（延迟降低时立即下调）
+BASELINE_WEIGHT = 0.1
+
+def percentile(values, q):
+    """最近秩法计算百分位数（20个样本的p95为第二大的值，单个异常值不会触发减半）"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * q) - 1, 0)]
+
+class AdaptiveConcurrency:
+    """AIMD 并发控制，所有会话共用（服务端的容量是共享的）
+
+    每连续成功“当前并发数”次（约一轮请求）并发数加一；遇到429、超时、服务端错误，
+    或某类调用最近的p95延迟超过该类基线的两倍时并发数减半。在上次减半之前发出的请求
+    不会再次触发减半（类似TCP拥塞控制），避免同一批失败的请求把并发数一路降到最低。
+    输出长度随阶段、模型和输出上限（生成配置、截断后加倍重试）变化很大，延迟按
+    (阶段, 模型, 输出上限) 分别统计，换用输出更长的配置不会被当作延迟突增。
+    """
+
+    def __init__(self, initial=4, max_limit=16, min_limit=1, enabled=False):
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.configure(initial, max_limit, enabled=enabled, min_limit=min_limit)
+
+    def configure(self, initial, max_limit, enabled=True, min_limit=1):
+        """设置初始并发数和上限并清空统计，enabled 为假时不限制也不调整
+
+        控制器由所有会话共用，应用只在创建时按部署配置设置一次；基准测试可在运行之间重新设置。
+        """
+        with self._cond:
+            self.enabled = enabled
+            self.min_limit = min_limit
+            self.max_limit = max(max_limit, min_limit)
+            self.limit = float(min(max(initial, min_limit), self.max_limit))
+            self.decreases = 0
+            self.last_reason = None
+            self._started = 0
+            self._decrease_barrier = 0
+            self._successes = 0
+            self._peak_in_flight = 0
+            self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+            self._baselines = {}
+            self._cond.notify_all()
+        metrics.LLM_CONCURRENCY_LIMIT.set(self.current_limit)
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """等待到有空闲的并发名额，返回本次请求的序号"""
+        with self._cond:
+            while self.enabled and self.in_flight >= self.current_limit:
+                self._cond.wait()
+            self.in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self.in_flight)
+            self._started += 1
+            ticket = self._started
+        metrics.LLM_IN_FLIGHT.inc()
+        try:
+            yield ticket
+        finally:
+            metrics.LLM_IN_FLIGHT.dec()
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def record_success(self, ticket, key, latency):
+        """记录一次成功的调用：延迟突增时减半，否则每轮加一
+
+        key 区分输出长度不同的调用，例如 (阶段, 模型, 输出上限)，延迟只与同一类调用比较。
+        """
+        with self._cond:
+            if not self.enabled:
+                return
+            window = self._latencies[key]
+            window.append(latency)
+            if len(window) >= MIN_LATENCY_SAMPLES:
+                p95 = percentile(window, 0.95)
+                baseline = self._baselines.get(key)
+                if baseline is not None and p95 > baseline * LATENCY_SPIKE_FACTOR:
+                    # 清空窗口，同一批慢请求只触发一次；降低并发后延迟仍然较高时，
+                    # 说明服务端整体变慢，以新的延迟作为基线，不再继续减半
+                    window.clear()
+                    self._baselines[key] = p95
+                    self._decrease(ticket, "latency")
+                    return
+                if baseline is None or p95 < baseline:
+                    self._baselines[key] = p95
+                else:
+                    self._baselines[key] = baseline + (p95 - baseline) * BASELINE_WEIGHT
+
+            self._successes += 1
+            # 请求数没有达到当前并发数时（例如剩下的学生不多了）不再增加
+            saturated = self._peak_in_flight >= self.current_limit
+            if self._successes >= self.current_limit and saturated and self.limit < self.max_limit:
+                self.limit = min(self.limit + INCREASE_STEP, self.max_limit)
+                self._changed()
+
+    def record_overload(self, ticket, reason):
+        """记录一次过载信号（限流、超时、服务端错误）"""
+        with self._cond:
+            if self.enabled:
+                self._decrease(ticket, reason)
+
+    def _decrease(self, ticket, reason):
+        if ticket <= self._decrease_barrier:
+            return
+        self.limit = max(self.limit * DECREASE_FACTOR, self.min_limit)
+        self._decrease_barrier = self._started
+        self.decreases += 1
+        self.last_reason = reason
+        metrics.LLM_CONCURRENCY_DECREASES.inc(reason=reason)
+        self._changed()
+
+    def _changed(self):
+        self._successes = 0
+        self._peak_in_flight = self.in_flight
+        metrics.LLM_CONCURRENCY_LIMIT.set(self.current_limit)
+        self._cond.notify_all()
@@ -0,0 +1,364 @@
+"""在渲染前对大模型生成的内容做本地质量检查（不额外调用大模型）"""
+import math
+import random
+import re
+import threading
+import zlib
+from datetime import datetime
+import numpy as np
+from generation_profiles import TASK_PARTS
+
+# 咨询记录每条信息的字数范围（提示词要求100-200字，上限允许少量超出）
+MIN_INFO_CHARS = 100
+MAX_INFO_CHARS = 250
+MIN_SUMMARY_CHARS = 100
+CONSULTATION_COUNT = 16
+
+# MinHash 参数：按4字切片，63个哈希函数，分成21个band（每个3行）做LSH。
+# 相似度0.5时成为候选的概率约94%（16个band每个4行时只有64%，见 quality_benchmark.py）
+SHINGLE_SIZE = 4
+NUM_PERM = 63
+LSH_BANDS = 21
+DUPLICATE_THRESHOLD = 0.5
+
+_PRIME = (1 << 31) - 1
+_rng = random.Random(2024)
+_PERM_A = np.array([_rng.randrange(1, _PRIME) for _ in range(NUM_PERM)], dtype=np.uint64)
+_PERM_B = np.array([_rng.randrange(0, _PRIME) for _ in range(NUM_PERM)], dtype=np.uint64)
+# 把一个band的几个哈希值合成一个分桶值时使用的乘数（按2^64取模）
+_BAND_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_IGNORED_CHARS = re.compile(r"[\s，。、；：！？,.;:!?“”\"'（）()]")
+
+def text_length(text):
+    """统计字数（不计空白字符）"""
+    return len(re.sub(r"\s", "", text or ""))
+
+def _format_issue(value):
+    """大模型返回的文本字段不是字符串（列表、数字等）时返回问题描述，否则返回None"""
+    if value is None or isinstance(value, str):
+        return None
+    return f"格式错误（应为文本，实际为{type(value).__name__}）"
+
+def minhash(text):
+    """计算文本字符切片的MinHash签名"""
+    normalized = _IGNORED_CHARS.sub("", text or "")
+    shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(max(len(normalized) - SHINGLE_SIZE + 1, 1))}
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64)
+    return ((_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+def similarity(sig_a, sig_b):
+    """用MinHash签名估计两段文本的Jaccard相似度"""
+    return float(np.mean(sig_a == sig_b))
+
+def _resized(array, capacity):
+    resized = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    resized[:len(array)] = array
+    return resized
+
+def _band_keys(signatures):
+    """每条签名在各个band的分桶值，形状为 (签名数, LSH_BANDS)"""
+    rows = NUM_PERM // LSH_BANDS
+    bands = signatures.astype(np.uint64).reshape(len(signatures), LSH_BANDS, rows)
+    keys = np.zeros((len(signatures), LSH_BANDS), dtype=np.uint64)
+    for row in range(rows):
+        keys = keys * _BAND_MULTIPLIER + bands[:, :, row]
+    return keys
+
+# 查重索引中尚未排序的新条目超过这个数时重新排序（较少的新条目直接逐个比较分桶值）
+UNSORTED_LIMIT = 2048
+# 查重时每次比较的候选对数
+COMPARE_CHUNK = 4096
+
+class DuplicateIndex:
+    """跨学生的近似重复检测索引（MinHash + LSH分桶）
+
+    签名和各band的分桶值按行追加保存在 numpy 矩阵中（容量不足时加倍），已写入的行不再修改，
+    查询只需在锁内取得当前数组和行数。较早的行按分桶值排好序，二分查找得到候选；之后追加的
+    行直接比较分桶值，超过 UNSORTED_LIMIT 行时在锁外重新排序。候选按 COMPARE_CHUNK 分块计算
+    相似度。每条签名约占0.7KB（2000个学生的64000条约45MB），添加时不复制已有的数据。
+    """
+
+    def __init__(self, threshold=DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._sort_lock = threading.Lock()
+        self._count = 0
+        self._signatures = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self._keys = np.empty((0, LSH_BANDS), dtype=np.uint64)
+        self._owners = np.empty(0, dtype=np.int32)
+        self._labels = np.empty(0, dtype=np.int32)
+        self._names = {"owner": [], "label": []}
+        self._ids = {"owner": {}, "label": {}}
+        # 前 _sorted_count 行按band排序后的分桶值和对应的行号，形状为 (LSH_BANDS, 行数)
+        self._sorted_count = 0
+        self._sorted_keys = np.empty((LSH_BANDS, 0), dtype=np.uint64)
+        self._sorted_rows = np.empty((LSH_BANDS, 0), dtype=np.int32)
+
+    def __len__(self):
+        return self._count
+
+    def _id(self, kind, name):
+        ids = self._ids[kind]
+        if name not in ids:
+            ids[name] = len(self._names[kind])
+            self._names[kind].append(name)
+        return ids[name]
+
+    def query_many(self, owner, sigs):
+        """对每条签名返回其他学生中与之近似重复的条目 [(学生, 条目标签, 相似度)]，按相似度从高到低排列"""
+        results = [[] for _ in sigs]
+        if not len(sigs):
+            return results
+        sigs = np.asarray(sigs, dtype=np.uint32)
+        queries = _band_keys(sigs)
+        with self._lock:
+            count, signatures, keys, owners, labels = self._count, self._signatures, self._keys, self._owners, self._labels
+            sorted_count, sorted_keys, sorted_rows = self._sorted_count, self._sorted_keys, self._sorted_rows
+            owner_id = self._ids["owner"].get(owner, -1)
+        if not count:
+            return results
+
+        query_ids, row_ids = [], []
+        for band in range(LSH_BANDS):
+            low = np.searchsorted(sorted_keys[band], queries[:, band], "left")
+            high = np.searchsorted(sorted_keys[band], queries[:, band], "right")
+            for q in np.nonzero(high > low)[0]:
+                rows = sorted_rows[band, low[q]:high[q]]
+                query_ids.append(np.full(len(rows), q, dtype=np.int32))
+                row_ids.append(rows)
+        # 尚未排序的行：任意一个band的分桶值相同即为候选
+        q, rows = np.nonzero((queries[:, None, :] == keys[None, sorted_count:count, :]).any(axis=2))
+        query_ids.append(q.astype(np.int32))
+        row_ids.append((rows + sorted_count).astype(np.int32))
+        # (查询序号, 行号) 编码为一个整数去重，去掉本学生自己的条目
+        pairs = np.unique(np.concatenate(query_ids).astype(np.int64) * count + np.concatenate(row_ids))
+        pairs = pairs[owners[pairs % count] != owner_id]
+
+        # 内容相近的学生很多时候选也很多（2000个学生时每次查询约十几万对），分块比较以限制临时数组的大小
+        min_matches = math.ceil(self.threshold * NUM_PERM)
+        for chunk in range(0, len(pairs), COMPARE_CHUNK):
+            q, rows = np.divmod(pairs[chunk:chunk + COMPARE_CHUNK], count)
+            matches = np.count_nonzero(signatures[rows] == sigs[q], axis=1)
+            for i in np.nonzero(matches >= min_matches)[0]:
+                results[q[i]].append((
+                    self._names["owner"][owners[rows[i]]], self._names["label"][labels[rows[i]]], float(matches[i] / NUM_PERM)
+                ))
+        for matches in results:
+            matches.sort(key=lambda match: -match[2])
+        return results
+
+    def query(self, owner, sig):
+        """返回其他学生中与签名近似重复的条目 [(学生, 条目标签, 相似度)]"""
+        return self.query_many(owner, [sig])[0]
+
+    def add_many(self, owner, items):
+        """添加一个学生的多条签名，items 为 [(条目标签, 签名)]"""
+        if not items:
+            return
+        sigs = np.asarray([sig for _, sig in items], dtype=np.uint32)
+        keys = _band_keys(sigs)
+        with self._lock:
+            start, end = self._count, self._count + len(items)
+            if end > len(self._signatures):
+                # 容量不足时加倍，正在查询的线程仍使用取到的旧数组
+                capacity = max(end, 2 * len(self._signatures), 256)
+                self._signatures = _resized(self._signatures, capacity)
+                self._keys = _resized(self._keys, capacity)
+                self._owners = _resized(self._owners, capacity)
+                self._labels = _resized(self._labels, capacity)
+            self._signatures[start:end] = sigs
+            self._keys[start:end] = keys
+            self._owners[start:end] = self._id("owner", owner)
+            self._labels[start:end] = [self._id("label", label) for label, _ in items]
+            self._count = end
+            unsorted = end - self._sorted_count
+        if unsorted > UNSORTED_LIMIT:
+            self._sort()
+
+    def _sort(self):
+        """在锁外为已有的全部行重新排序，同一时间只有一个线程排序"""
+        if not self._sort_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                count, keys = self._count, self._keys
+            band_keys = keys[:count].T
+            rows = np.argsort(band_keys, axis=1, kind="stable").astype(np.int32)
+            sorted_keys = np.take_along_axis(band_keys, rows, axis=1)
+            with self._lock:
+                self._sorted_count, self._sorted_keys, self._sorted_rows = count, sorted_keys, rows
+        finally:
+            self._sort_lock.release()
+
+    def add(self, owner, label, sig):
+        self.add_many(owner, [(label, sig)])
+
+def _issue(item, problem, index=None):
+    return {"item": item, "index": index, "problem": problem}
+
+def validate_task_content(task_content):
+    """检查任务书内容是否包含所有必需字段"""
+    if not isinstance(task_content, dict):
+        return [_issue("task", "任务书内容不是JSON对象")]
+    return [
+        _issue("task", f"缺少“{part_name}”（{key}）")
+        for key, part_name in TASK_PARTS
+        if not task_content.get(key)
+    ]
+
+def is_well_formed(task_content, ai_content):
+    """检查生成内容的结构能否直接渲染（只检查字段和类型，不检查字数、日期等质量问题）"""
+    if not isinstance(task_content, dict) or validate_task_content(task_content):
+        return False
+    if not isinstance(ai_content, dict):
+        return False
+    consultations = ai_content.get("consultations")
+    if not isinstance(consultations, list) or len(consultations) != CONSULTATION_COUNT:
+        return False
+    for consultation in consultations:
+        if not isinstance(consultation, dict):
+            return False
+        if not all(isinstance(consultation.get(key), str) for key in ("date", "student_info", "teacher_info")):
+            return False
+    return all(isinstance(ai_content.get(key), str) for key in ("work_summary", "mid_term_review"))
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(str(value).strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+def _longest_ordered(dates):
+    """dates 为 [(序号, 日期)]，返回日期不递减的最长子序列中的序号"""
+    lengths = [1] * len(dates)
+    previous = [None] * len(dates)
+    for b in range(len(dates)):
+        for a in range(b):
+            if dates[a][1] <= dates[b][1] and lengths[a] + 1 > lengths[b]:
+                lengths[b] = lengths[a] + 1
+                previous[b] = a
+    kept = set()
+    b = max(range(len(dates)), key=lengths.__getitem__) if dates else None
+    while b is not None:
+        kept.add(dates[b][0])
+        b = previous[b]
+    return kept
+
+def validate_ai_content(ai_content, start_date, end_date, owner=None, index=None):
+    """检查咨询内容的格式、字数、日期和重复情况，返回问题列表
+
+    传入 index 时还会检查与其他学生已通过检查的内容是否近似重复。
+    """
+    if not isinstance(ai_content, dict):
+        return [_issue("ai_content", "咨询内容不是JSON对象")]
+
+    issues = []
+    consultations = ai_content.get("consultations")
+    if not isinstance(consultations, list):
+        consultations = []
+    for i in range(len(consultations), CONSULTATION_COUNT):
+        issues.append(_issue("consultation", "缺少该条咨询记录", i))
+
+    signatures = []
+    dates = []
+    for i, consultation in enumerate(consultations[:CONSULTATION_COUNT]):
+        if not isinstance(consultation, dict):
+            issues.append(_issue("consultation", "咨询记录格式错误", i))
+            continue
+
+        consultation_date = _parse_date(consultation.get("date", ""))
+        if consultation_date is None:
+            issues.append(_issue("consultation", f"日期格式错误：{consultation.get('date')}", i))
+        elif not start_date <= consultation_date <= end_date:
+            issues.append(_issue("consultation", f"日期{consultation_date}不在执行期内", i))
+        else:
+            dates.append((i, consultation_date))
+
+        for field, field_name in (("student_info", "学生信息"), ("teacher_info", "教师信息")):
+            problem = _format_issue(consultation.get(field))
+            if problem:
+                issues.append(_issue("consultation", f"{field_name}{problem}", i))
+                continue
+            length = text_length(consultation.get(field, ""))
+            if length < MIN_INFO_CHARS:
+                issues.append(_issue("consultation", f"{field_name}字数不足（{length}字）", i))
+            elif length > MAX_INFO_CHARS:
+                issues.append(_issue("consultation", f"{field_name}字数过多（{length}字）", i))
+            elif length:
+                signatures.append((i, field_name, minhash(consultation[field])))
+
+    # 只标出最少需要修改的日期，一个日期出错时不会连带后面的咨询也被判为顺序错误
+    in_order = _longest_ordered(dates)
+    for i, consultation_date in dates:
+        if i not in in_order:
+            issues.append(_issue("consultation", f"日期{consultation_date}与前后咨询的先后顺序不一致", i))
+
+    # 同一学生的16次咨询之间不应有近似重复
+    for b in range(1, len(signatures)):
+        j, name_j, sig_j = signatures[b]
+        for i, name_i, sig_i in signatures[:b]:
+            score = similarity(sig_i, sig_j)
+            if score >= DUPLICATE_THRESHOLD:
+                issues.append(_issue("consultation", f"{name_j}与第{i + 1}次咨询的{name_i}近似重复（相似度{score:.0%}）", j))
+                break
+
+    # 与其他学生的内容近似重复
+    if index is not None:
+        matches = index.query_many(owner, [sig for _, _, sig in signatures])
+        for (i, field_name, _), found in zip(signatures, matches):
+            for other_owner, label, score in found[:1]:
+                issues.append(_issue("consultation", f"{field_name}与{other_owner}的{label}近似重复（相似度{score:.0%}）", i))
+
+    for field, field_name in (("work_summary", "工作总结"), ("mid_term_review", "中期检查评价")):
+        problem = _format_issue(ai_content.get(field))
+        if problem:
+            issues.append(_issue(field, f"{field_name}{problem}"))
+            continue
+        length = text_length(ai_content.get(field, ""))
+        if length < MIN_SUMMARY_CHARS:
+            issues.append(_issue(field, f"{field_name}字数不足（{length}字）"))
+
+    return issues
+
+class QualityGate:
+    """一个批次内的质量检查：保存跨学生的查重索引和每个学生的检查报告"""
+
+    def __init__(self):
+        self.index = DuplicateIndex()
+        self.report = []
+
+    def check_task(self, task_content):
+        return validate_task_content(task_content)
+
+    def check_ai_content(self, owner, ai_content, start_date, end_date):
+        # 查重索引自带锁，多个学生的检查可以并行进行
+        return validate_ai_content(ai_content, start_date, end_date, owner, self.index)
+
+    def accept(self, owner, ai_content):
+        """将学生最终采用的咨询内容加入查重索引"""
+        consultations = ai_content.get("consultations") if isinstance(ai_content, dict) else None
+        if not isinstance(consultations, list):
+            return
+        items = []
+        for i, consultation in enumerate(consultations[:CONSULTATION_COUNT]):
+            if not isinstance(consultation, dict):
+                continue
+            for field, field_name in (("student_info", "学生信息"), ("teacher_info", "教师信息")):
+                if consultation.get(field) and isinstance(consultation[field], str):
+                    items.append((f"第{i + 1}次咨询{field_name}", minhash(consultation[field])))
+        self.index.add_many(owner, items)
+
+    def record(self, owner, initial_issues, regenerations, remaining_issues):
+        self.report.append({
+            "学生姓名": owner,
+            "初始问题数": len(initial_issues),
+            "重新生成次数": regenerations,
+            "剩余问题数": len(remaining_issues),
+            "剩余问题": "；".join(describe_issue(issue) for issue in remaining_issues)
+        })
+
+def describe_issue(issue):
+    """将问题转换为可读的描述"""
+    if issue["item"] == "consultation":
+        return f"第{issue['index'] + 1}次咨询：{issue['problem']}"
+    return issue["problem"]
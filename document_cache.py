@@ -0,0 +1,173 @@
+"""生成内容和渲染文档的磁盘缓存"""
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from settings import get_setting, get_int_setting
+
+# 缓存目录，可通过环境变量或 secrets.toml 修改
+CACHE_DIR = get_setting("THESIS_CACHE_DIR", ".thesis_cache")
+# 缓存总大小上限（MB）和最长保留天数，设为0表示不限制（无法解析时使用默认值）
+CACHE_MAX_MB = get_int_setting("THESIS_CACHE_MAX_MB", 2048)
+CACHE_MAX_AGE_DAYS = get_int_setting("THESIS_CACHE_MAX_AGE_DAYS", 90)
+# 最近一小时内用过的文件不清理（其他会话可能正在打包这些文件）
+PRUNE_GRACE_SECONDS = 3600
+
+# 模板文件哈希的内存缓存：(路径, 修改时间, 大小) -> 哈希
+_template_hashes = {}
+
+def hash_bytes(data):
+    """计算字节内容的SHA-256哈希"""
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(file):
+    """计算本地文件或上传文件的内容哈希"""
+    if isinstance(file, (str, os.PathLike)):
+        stat = os.stat(file)
+        memo_key = (os.fspath(file), stat.st_mtime_ns, stat.st_size)
+        if memo_key not in _template_hashes:
+            with open(file, "rb") as f:
+                _template_hashes[memo_key] = hash_bytes(f.read())
+        return _template_hashes[memo_key]
+    return hash_bytes(file.getvalue())
+
+def hash_json(payload):
+    """计算可JSON序列化对象的稳定哈希"""
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hash_bytes(text.encode("utf-8"))
+
+def render_key(template_path, context, images):
+    """根据模板文件、文本上下文和签名图片计算渲染结果的缓存键"""
+    return hash_json({
+        "template": hash_file(template_path),
+        "context": context,
+        "images": {name: hash_file(image) for name, image in images.items()}
+    })
+
+def atomic_write(path, data):
+    """先写入临时文件再替换，避免并发读到写了一半的缓存"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def atomic_move(src, path):
+    """将文件移动到 path：先移动到目标目录中的临时文件再替换，中途出错时不会留下不完整的文件"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    try:
+        shutil.move(src, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+def mark_used(path):
+    """更新缓存文件的修改时间，清理缓存时按最近使用时间淘汰"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+class DocumentCache:
+    """按渲染上下文哈希缓存渲染好的 .docx 文件"""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = os.path.join(cache_dir, "documents")
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.docx")
+
+    def lookup(self, key):
+        """命中时返回缓存文件路径，否则返回None"""
+        path = self.path_for(key)
+        if os.path.exists(path):
+            self.hits += 1
+            mark_used(path)
+            return path
+        self.misses += 1
+        return None
+
+    def store(self, key, data):
+        """写入渲染结果并返回缓存文件路径"""
+        path = self.path_for(key)
+        atomic_write(path, data)
+        return path
+
+class ContentCache:
+    """按学生信息和生成配置缓存大模型生成的任务书和咨询内容"""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = os.path.join(cache_dir, "content")
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def contains(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def load(self, key):
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        mark_used(path)
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, key, content):
+        data = json.dumps(content, ensure_ascii=False, default=str).encode("utf-8")
+        atomic_write(self.path_for(key), data)
+
+def prune_cache(cache_dir=CACHE_DIR, max_mb=CACHE_MAX_MB, max_age_days=CACHE_MAX_AGE_DAYS):
+    """清理缓存：删除超过保留天数的文件，总大小仍超过上限时从最久未使用的文件开始删除
+
+    返回 (删除的文件数, 释放的字节数)。
+    """
+    entries = []
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    removed = freed = 0
+    for mtime, size, path in entries:
+        expired = max_age_days and now - mtime > max_age_days * 86400
+        oversized = max_mb and total > max_mb * 1024 * 1024
+        # 按使用时间从旧到新排列，遇到第一个需要保留的文件即可停止
+        if not (expired or oversized) or now - mtime < PRUNE_GRACE_SECONDS:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        with contextlib.suppress(OSError):
+            # 按哈希前两位分的子目录为空时一并删除
+            os.rmdir(os.path.dirname(path))
+        total -= size
+        removed += 1
+        freed += size
+    return removed, freed
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """删除全部缓存"""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    _template_hashes.clear()
@@ -0,0 +1,51 @@
+"""将多个学生的文档合并成一个便于打印的 .docx"""
+import os
+from docx import Document
+from docxcompose.composer import Composer
+
+class CohortMerger:
+    """逐个追加学生文档，生成带分页的合并文档
+
+    每个学生的文档从渲染缓存读入、追加后立即释放，内存中只保留正在合并的文档。
+    默认每组只生成一个合并文档；chunk_size 大于0时每满 chunk_size 个学生就把当前合并文档
+    写到磁盘并开始下一卷，内存占用取决于分卷大小而不是组内学生数。
+    """
+
+    def __init__(self, name, out_dir, chunk_size=0):
+        self.name = name
+        self.out_dir = out_dir
+        self.chunk_size = chunk_size
+        self.paths = []
+        self._composer = None
+        self._count = 0
+
+    def add(self, docx_path):
+        doc = Document(docx_path)
+        if self._composer is None:
+            self._composer = Composer(doc)
+        else:
+            # 每个学生的文档从新的一页开始
+            self._composer.doc.add_page_break()
+            self._composer.append(doc)
+        self._count += 1
+        if self.chunk_size and self._count >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """写出当前分卷，返回文件路径（没有内容时返回None）"""
+        if self._composer is None:
+            return None
+        if self.chunk_size:
+            path = os.path.join(self.out_dir, f"{self.name}-{len(self.paths) + 1:02d}.docx")
+        else:
+            path = os.path.join(self.out_dir, f"{self.name}.docx")
+        self._composer.save(path)
+        self.paths.append(path)
+        self._composer = None
+        self._count = 0
+        return path
+
+    def close(self):
+        """写出剩余内容并返回所有分卷的路径"""
+        self.flush()
+        return self.paths
@@ -0,0 +1,104 @@
+"""生成配置、任务书字段和提示词的构造
+
+不依赖大模型客户端，导入时不读取API密钥，离线脚本（估算、基准测试）可以直接使用。
+"""
+from prompt_templates import (
+    TASK_PROMPT,
+    TASK_PROMPT_COMPACT,
+    CONSULTATION_PROMPT,
+    CONSULTATION_PROMPT_COMPACT
+)
+from settings import get_setting
+
+# 定义每次咨询的关键字
+consultation_keywords = [
+    {"student": "选题讨论", "teacher": "方向建议"},
+    {"student": "文献综述", "teacher": "资料推荐"},
+    {"student": "研究方法", "teacher": "实验设计"},
+    {"student": "数据收集", "teacher": "分析方法"},
+    {"student": "初步结果", "teacher": "改进建议"},
+    {"student": "论文大纲", "teacher": "结构优化"},
+    {"student": "实验进展", "teacher": "数据解释"},
+    {"student": "章节撰写", "teacher": "内容审阅"},
+    {"student": "统计分析", "teacher": "结果讨论"},
+    {"student": "图表制作", "teacher": "可视化建议"},
+    {"student": "讨论部分", "teacher": "深度分析"},
+    {"student": "结论总结", "teacher": "贡献点确认"},
+    {"student": "摘要撰写", "teacher": "关键词确定"},
+    {"student": "参考文献", "teacher": "格式检查"},
+    {"student": "论文定稿", "teacher": "最终修改"},
+    {"student": "答辩准备", "teacher": "预答辩指导"}
+]
+
+# 任务书的各个部分（字段名, 显示名称）
+TASK_PARTS = [
+    ("task_content", "课题的任务内容"),
+    ("original_conditions", "原始条件及数据"),
+    ("technical_requirements", "设计的技术要求"),
+    ("specific_work", "应完成的具体工作"),
+    ("reference_requirements", "资料文献要求")
+]
+
+# 生成咨询内容时使用的任务书摘要字段
+DIGEST_KEYS = ["task_content", "technical_requirements"]
+
+# 默认模型：可在 secrets.toml 或环境变量中用 DEEPSEEK_MODEL 修改，
+# 也可用 DEEPSEEK_TASK_MODEL、DEEPSEEK_CONSULTATION_MODEL 为每个阶段单独指定
+DEFAULT_MODEL = "deepseek-chat"
+GENERATION_STAGES = ("task", "consultation")
+
+# 生成配置：每个阶段的提示词模板和输出上限（max_tokens 为 None 表示不限制），
+# “精简”配置的提示词要求的条目数和字数更少，输出上限按此设置
+GENERATION_PROFILES = {
+    "标准": {
+        "task": {"template": TASK_PROMPT, "max_tokens": None},
+        "consultation": {"template": CONSULTATION_PROMPT, "max_tokens": None},
+        "use_digest": False
+    },
+    "精简": {
+        "task": {"template": TASK_PROMPT_COMPACT, "max_tokens": 2048},
+        "consultation": {"template": CONSULTATION_PROMPT_COMPACT, "max_tokens": 6144},
+        "use_digest": True
+    }
+}
+DEFAULT_PROFILE = "标准"
+
+def stage_model(stage):
+    """读取某个阶段使用的模型"""
+    return get_setting(f"DEEPSEEK_{stage.upper()}_MODEL") or get_setting("DEEPSEEK_MODEL", DEFAULT_MODEL)
+
+def get_generation_profile(profile=None):
+    """按名称获取生成配置（每个阶段的模型从配置中读取），未指定时使用默认配置"""
+    name = profile or DEFAULT_PROFILE
+    if name not in GENERATION_PROFILES:
+        raise ValueError(f"未知的生成配置：{name}")
+    config = GENERATION_PROFILES[name]
+    return {**config, **{stage: {**config[stage], "model": stage_model(stage)} for stage in GENERATION_STAGES}}
+
+def format_task_part(value):
+    """将任务书的某一部分转换为多行文本（列表按行拼接，字符串原样返回）"""
+    if isinstance(value, list):
+        return "\n".join(str(item) for item in value)
+    return value or ""
+
+def build_task_description(task_parts, profile=None):
+    """根据生成配置拼接用于生成咨询内容的任务书描述"""
+    if get_generation_profile(profile)["use_digest"]:
+        keys = [key for key in DIGEST_KEYS if key in task_parts]
+    else:
+        keys = list(task_parts)
+    return "\n".join(format_task_part(task_parts[key]) for key in keys)
+
+def build_task_messages(title, major, start_date, end_date, additional_info="", profile=None):
+    """按生成配置构造生成任务书内容的提示词"""
+    return get_generation_profile(profile)["task"]["template"].render(title=title, major=major, additional_info=additional_info)
+
+def build_consultation_messages(task_description, start_date, end_date, title, additional_info="", profile=None):
+    """按生成配置构造生成咨询内容的提示词"""
+    return get_generation_profile(profile)["consultation"]["template"].render(
+        title=title,
+        task_description=task_description,
+        additional_info=additional_info,
+        start_date=start_date.strftime('%Y-%m-%d'),
+        end_date=end_date.strftime('%Y-%m-%d')
+    )
@@ -0,0 +1,199 @@
+"""测量批量生成流程的内存峰值随学生数的变化（使用合成数据和模拟大模型服务）
+
+用法：
+    python memory_benchmark.py --students 50 200 500 2000
+    python memory_benchmark.py --mode replay --students 2000
+
+每个学生数在单独的子进程中运行，以免前一次运行的内存影响结果。默认按页面的默认流程运行：
+通过模拟服务生成内容（开启质量检查和内容缓存），渲染并写入磁盘上的ZIP，再按 Streamlit
+处理下载按钮的方式读取ZIP。--mode replay 改为把合成的生成内容写入 JSONL 后按
+“上传生成内容重新渲染”的流程逐行读取。
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from generation_profiles import TASK_PARTS
+
+# 每个学生使用不同的文字，保证每个文档都需要重新渲染
+_CHARS = "研究设计系统实现分析数据模型算法优化测试结果方法技术应用平台功能需求性能评价论文实验"
+
+def _text(rng, length):
+    return "".join(rng.choice(_CHARS) for _ in range(length))
+
+def synthetic_record(i):
+    """生成一个学生的合成记录（格式与导出的生成内容相同）"""
+    rng = random.Random(i)
+    start_date = date(2024, 3, 1)
+    end_date = date(2024, 6, 1)
+    row = {
+        "论文题目": f"基于{_text(rng, 6)}的{_text(rng, 8)}研究",
+        "学生姓名": f"学生{i:05d}",
+        "学生学号": f"2020{i:05d}",
+        "指导教师": "李四",
+        "专业": "计算机科学与技术",
+        "学院": "经济与管理学院",
+        "开始日期": start_date.isoformat(),
+        "结束日期": end_date.isoformat(),
+        "补充信息": ""
+    }
+    task_content = {key: _text(rng, 300) for key, _ in TASK_PARTS}
+    ai_content = {
+        "consultations": [
+            {
+                "date": (start_date + timedelta(days=5 * k + 1)).isoformat(),
+                "student_info": _text(rng, 150),
+                "teacher_info": _text(rng, 150)
+            }
+            for k in range(16)
+        ],
+        "work_summary": _text(rng, 200),
+        "mid_term_review": _text(rng, 200)
+    }
+    return {"version": 1, "row": row, "task_content": task_content, "ai_content": ai_content}
+
+def make_signature(path):
+    from PIL import Image
+    Image.new("RGB", (200, 80), "white").save(path)
+
+def download_archive(archive_path):
+    """按 Streamlit 处理下载按钮的方式读取ZIP：点击时执行回调并把结果放入媒体文件存储，
+    之后两次清理孤立文件时删除，返回下载的字节数"""
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from batch_generation_app import read_archive
+
+    manager = MediaFileManager(MemoryMediaFileStorage("/media"))
+    file_id = manager.add_deferred(read_archive(archive_path), "application/zip", "benchmark", "archive.zip")
+    url = manager.execute_deferred(file_id)
+    size = len(manager._storage.get_file(url.rsplit("/", 1)[-1].split(".", 1)[0]).content)
+    manager.remove_orphaned_files()
+    manager.remove_orphaned_files()
+    return size
+
+def generated_results(students, work_dir, memory_limit_mb):
+    """通过模拟服务生成内容（与页面默认设置相同：开启质量检查和内容缓存），返回结果和质量检查器"""
+    from openai import OpenAI
+    import student_consultation_app
+    from batch_generation_app import generate_contents
+    from content_validator import QualityGate
+    from document_cache import ContentCache
+    from mock_llm_server import MockLLMServer
+
+    server = MockLLMServer(capacities=(64,), base_latency=0.01, defect_rate=0.02, seed=0).start()
+    student_consultation_app.client = OpenAI(api_key="mock", base_url=server.url, max_retries=0)
+    quality_gate = QualityGate()
+    rows = (synthetic_record(i)["row"] for i in range(students))
+    results = generate_contents(
+        rows, 16, content_cache=ContentCache(os.path.join(work_dir, "cache")), quality_gate=quality_gate,
+        usage_log=[], memory_limit_mb=memory_limit_mb
+    )
+    return results, quality_gate
+
+def run_worker(students, memory_limit_mb, mode):
+    """在当前进程中处理指定数量的学生，以JSON输出耗时和内存峰值"""
+    import batch_generation_app
+    from batch_generation_app import build_archive, replay_contents, publish_archive, current_rss_mb, resource
+    from document_cache import DocumentCache
+    from replay_store import iter_replay_file
+
+    def fail(row, message, error):
+        raise RuntimeError(message) from error
+
+    # 模板文件按相对路径查找
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as work_dir, contextlib.ExitStack() as stack:
+        batch_generation_app.DOWNLOAD_DIR = os.path.join(work_dir, "downloads")
+        signature_path = os.path.join(work_dir, "signature.png")
+        make_signature(signature_path)
+        if mode == "replay":
+            replay_path = os.path.join(work_dir, "replay.jsonl")
+            with open(replay_path, "w", encoding="utf-8") as f:
+                for i in range(students):
+                    f.write(json.dumps(synthetic_record(i), ensure_ascii=False) + "\n")
+
+        baseline = current_rss_mb()
+        peak = baseline
+        started = time.perf_counter()
+
+        def track(done, row):
+            nonlocal peak
+            peak = max(peak, current_rss_mb())
+
+        if mode == "replay":
+            results = replay_contents(iter_replay_file(stack.enter_context(open(replay_path, "rb"))))
+            quality_gate = None
+        else:
+            results, quality_gate = generated_results(students, work_dir, memory_limit_mb)
+        zip_path = os.path.join(work_dir, "archive.zip")
+        build_archive(
+            results,
+            zip_path,
+            signature_path,
+            signature_path,
+            document_cache=DocumentCache(os.path.join(work_dir, "cache")),
+            quality_gate=quality_gate,
+            on_progress=track,
+            on_error=fail
+        )
+        seconds = time.perf_counter() - started
+
+        zip_mb = os.path.getsize(zip_path) / 1024 / 1024
+        if resource is not None:
+            peak = max(peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+        # 下载时ZIP才读入内存，下载结束后的内存反映会话中是否仍保留ZIP
+        downloaded_mb = download_archive(publish_archive(zip_path)) / 1024 / 1024
+        download_peak = peak
+        if resource is not None:
+            download_peak = max(peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+        print(json.dumps({
+            "students": students,
+            "seconds": seconds,
+            "baseline_mb": baseline,
+            "peak_mb": peak,
+            "zip_mb": zip_mb,
+            "downloaded_mb": downloaded_mb,
+            "download_peak_mb": download_peak,
+            "after_download_mb": current_rss_mb(),
+            "over_limit": bool(memory_limit_mb) and peak > memory_limit_mb
+        }))
+
+def main():
+    parser = argparse.ArgumentParser(description="测量批量生成流程的内存峰值随学生数的变化")
+    parser.add_argument("--students", nargs="+", type=int, default=[50, 200, 500, 2000])
+    parser.add_argument("--memory-limit", type=int, default=1024, help="内存上限（MB），超过时在结果中标出")
+    parser.add_argument("--mode", choices=["generate", "replay"], default="generate",
+                        help="generate：通过模拟服务生成内容（默认流程）；replay：从导出的生成内容重新渲染")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.memory_limit, args.mode)
+        return
+
+    report = [
+        f"{'学生数':>8}{'耗时(秒)':>12}{'启动内存(MB)':>14}{'内存峰值(MB)':>14}{'ZIP大小(MB)':>14}"
+        f"{'下载时峰值(MB)':>16}{'下载后内存(MB)':>16}"
+    ]
+    for students in args.students:
+        output = subprocess.run(
+            [sys.executable, __file__, "--worker", str(students), "--memory-limit", str(args.memory_limit), "--mode", args.mode],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        report.append(
+            f"{result['students']:>8}{result['seconds']:>12.1f}{result['baseline_mb']:>14.0f}"
+            f"{result['peak_mb']:>14.0f}{result['zip_mb']:>14.1f}"
+            f"{result['download_peak_mb']:>16.0f}{result['after_download_mb']:>16.0f}"
+            + ("  超过上限" if result["over_limit"] else "")
+        )
+        print(report[-1] if len(report) > 2 else "\n".join(report), flush=True)
+
+if __name__ == "__main__":
+    main()
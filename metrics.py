@@ -0,0 +1,257 @@
+"""运行指标（Prometheus 文本格式），通过本地HTTP端口或文本文件导出
+
+配置（环境变量或 secrets.toml，见 settings.py）：
+    THESIS_METRICS_PORT      HTTP端口，默认9108，设为0时不启动
+    THESIS_METRICS_ADDR      监听地址，默认只监听本机
+    THESIS_METRICS_TEXTFILE  定期写入指标的文件路径（供 node_exporter 的 textfile collector 读取），默认不写
+"""
+import contextlib
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from document_cache import atomic_write
+from settings import get_setting, get_int_setting
+
+METRICS_PORT = get_int_setting("THESIS_METRICS_PORT", 9108)
+METRICS_ADDR = get_setting("THESIS_METRICS_ADDR", "127.0.0.1")
+METRICS_TEXTFILE = get_setting("THESIS_METRICS_TEXTFILE", "")
+TEXTFILE_INTERVAL = 15
+
+# 大模型调用耗时的分桶（秒）
+LLM_BUCKETS = (1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300)
+# 渲染和保存文档耗时的分桶（秒）
+DOCUMENT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+class Registry:
+    """保存所有指标，按注册顺序输出"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """生成 Prometheus 文本格式的全部指标"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要的标签为：{', '.join(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0.0)]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextlib.contextmanager
+    def track(self, **labels):
+        """在 with 块内将值加一，退出时减一"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    """按分桶统计耗时等观测值的分布"""
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DOCUMENT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """记录 with 块的耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+# 大模型调用（stage 为调用的函数名，如 generate_task_description、generate_all_ai_content）
+LLM_REQUEST_SECONDS = Histogram(
+    "thesis_llm_request_seconds", "大模型调用耗时（秒），只统计成功的调用", ("stage", "model"), LLM_BUCKETS
+)
+LLM_TOKENS = Counter("thesis_llm_tokens_total", "大模型调用的token数（direction为prompt或completion）", ("stage", "direction"))
+LLM_RETRIES = Counter("thesis_llm_retries_total", "大模型调用因限流、超时等临时错误而重试的次数", ("stage", "reason"))
+LLM_ERRORS = Counter("thesis_llm_errors_total", "大模型调用最终失败的次数（按错误类型）", ("stage", "error"))
+LLM_IN_FLIGHT = Gauge("thesis_llm_requests_in_flight", "正在进行的大模型调用数")
+LLM_CONCURRENCY_LIMIT = Gauge("thesis_llm_concurrency_limit", "自动调整的大模型调用并发数上限")
+LLM_CONCURRENCY_DECREASES = Counter("thesis_llm_concurrency_decreases_total", "并发数因过载而减半的次数", ("reason",))
+QUALITY_REGENERATIONS = Counter("thesis_quality_regenerations_total", "质量检查未通过后重新生成的次数", ("item",))
+
+# 缓存
+CACHE_REQUESTS = Counter("thesis_cache_requests_total", "缓存查询次数（result为hit或miss）", ("cache", "result"))
+CACHE_HIT_RATIO = Gauge("thesis_cache_hit_ratio", "进程启动以来的缓存命中率", ("cache",))
+
+# 文档
+TEMPLATE_RENDER_SECONDS = Histogram("thesis_template_render_seconds", "填充模板耗时（秒）", ("template",))
+DOCX_SAVE_SECONDS = Histogram("thesis_docx_save_seconds", "保存 .docx 耗时（秒）", ("template",))
+
+# 批量生成
+BATCH_QUEUE_DEPTH = Gauge("thesis_batch_queue_depth", "已提交到线程池但结果尚未处理的学生数")
+BATCH_IN_PROGRESS = Gauge("thesis_batch_students_in_progress", "正在生成内容的学生数")
+BATCH_STUDENTS = Counter("thesis_batch_students_total", "已处理的学生数（result为ok或error）", ("result",))
+
+def record_cache_lookup(cache, hit):
+    """记录一次缓存查询并更新命中率"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+    hits = CACHE_REQUESTS.value(cache=cache, result="hit")
+    total = hits + CACHE_REQUESTS.value(cache=cache, result="miss")
+    CACHE_HIT_RATIO.set(hits / total, cache=cache)
+
+def record_llm_usage(stage, model, latency, prompt_tokens, completion_tokens):
+    LLM_REQUEST_SECONDS.observe(latency, stage=stage, model=model)
+    LLM_TOKENS.inc(prompt_tokens, stage=stage, direction="prompt")
+    LLM_TOKENS.inc(completion_tokens, stage=stage, direction="completion")
+
+def write_textfile(path, registry=REGISTRY):
+    """将当前指标写入文件（先写临时文件再替换，采集时不会读到写了一半的内容）"""
+    atomic_write(os.path.abspath(path), registry.render().encode("utf-8"))
+
+def start_http_server(port, addr="127.0.0.1", registry=REGISTRY):
+    """在后台线程中提供 /metrics，返回 server 对象"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def _textfile_loop(path, interval):
+    while True:
+        try:
+            write_textfile(path)
+        except OSError:
+            pass
+        time.sleep(interval)
+
+_exporter_lock = threading.Lock()
+_exporter_started = False
+
+def start_exporter():
+    """按环境变量启动指标导出（每个进程只启动一次，Streamlit 重新运行脚本时不会重复启动）"""
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+        if METRICS_PORT:
+            try:
+                start_http_server(METRICS_PORT, METRICS_ADDR)
+            except OSError:
+                # 端口已被占用（例如同一台机器上运行了多个实例）时不影响页面使用
+                pass
+        if METRICS_TEXTFILE:
+            threading.Thread(
+                target=_textfile_loop, args=(METRICS_TEXTFILE, TEXTFILE_INTERVAL), name="metrics-textfile", daemon=True
+            ).start()
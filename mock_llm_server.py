@@ -0,0 +1,259 @@
+"""模拟大模型服务（OpenAI 兼容的 /chat/completions），用于测试并发控制
+
+服务端容量（同时处理的请求数）按阶段逐步下降，超过容量的请求返回429，
+处理中的请求越多延迟越高。返回的内容格式和字数与真实输出相近，可按 --defect-rate 的概率
+在咨询记录中加入问题，用于测试质量检查和重新生成。用法：
+    python mock_llm_server.py --port 8765 --capacity 12 6 3 --phase-seconds 60
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8765 streamlit run batch_generation_app.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TASK_KEYS = ["task_content", "original_conditions", "technical_requirements", "specific_work", "reference_requirements"]
+# 生成咨询内容的输出比任务书长，延迟按倍数放大
+CONSULTATION_LATENCY_FACTOR = 3.0
+
+# 拼接咨询记录的短语：不同学生的内容会共用一些短语，与真实输出的重合程度相近
+_ACTIONS = ["完成了", "修改了", "补充了", "重新整理了", "初步完成了", "细化了", "验证了", "调整了", "梳理了", "优化了"]
+_SUBJECTS = [
+    "文献综述", "研究框架", "实验方案", "数据采集", "问卷设计", "模型构建", "指标体系", "对比实验", "案例分析", "论文初稿",
+    "第三章", "参数设置", "样本数据", "回归分析", "系统原型", "算法改进", "结果讨论", "图表", "参考文献", "答辩材料"
+]
+_DETAILS = [
+    "关键变量的定义", "相关的研究假设", "数据预处理流程", "样本的选取标准", "评价指标的计算方法",
+    "实验的对照设置", "各章节之间的逻辑关系", "模型的训练参数", "异常值的处理方式", "国内外研究现状的比较"
+]
+_PROBLEMS = [
+    "发现部分数据存在缺失", "遇到模型收敛较慢的问题", "对比结果的差异不够明显", "部分文献的结论相互矛盾",
+    "样本量略显不足", "图表格式还不统一", "变量之间存在较强的相关性", "实验环境的配置花费了较多时间"
+]
+_PLANS = [
+    "下一步准备扩大样本范围", "计划下周完成剩余的实验", "接下来将重点完善讨论部分", "后续会按要求统一格式",
+    "准备查阅更多近五年的文献", "计划补充两组对比实验", "将尝试调整模型结构", "准备先完成初稿再逐步修改"
+]
+_DATE = re.compile(r"(\d{4}-\d{2}-\d{2})")
+
+def synthetic_paragraph(rng, min_chars=120, max_chars=180):
+    """用短语随机拼接一段咨询记录风格的文字"""
+    sentences = []
+    while sum(map(len, sentences)) < min_chars:
+        sentence = (
+            f"{rng.choice(_ACTIONS)}{rng.choice(_SUBJECTS)}中{rng.choice(_DETAILS)}，"
+            f"{rng.choice(_PROBLEMS)}，{rng.choice(_PLANS)}。"
+        )
+        if sentences and sum(map(len, sentences)) + len(sentence) > max_chars:
+            break
+        sentences.append(sentence)
+    return "".join(sentences)
+
+def _prompt_dates(prompt):
+    """提示词中的开始和结束日期"""
+    dates = [date.fromisoformat(value) for value in _DATE.findall(prompt.split("时间安排", 1)[-1])[:2]]
+    return (dates[0], dates[1]) if len(dates) == 2 else (date(2024, 3, 1), date(2024, 6, 1))
+
+def _task_content(rng):
+    return {key: [f"{i + 1}. {synthetic_paragraph(rng, 40, 80)}" for i in range(3)] for key in TASK_KEYS}
+
+def _consultation_content(rng, prompt, defect_rate=0.0):
+    """16次咨询记录；按 defect_rate 的概率在咨询记录中加入字数不足、与上一次重复、日期超出范围
+    或字段类型错误（文本返回为列表）的问题
+
+    返回 (内容, 加入的问题数)。
+    """
+    start_date, end_date = _prompt_dates(prompt)
+    consultations = []
+    defects = 0
+    for i in range(16):
+        consultation = {
+            "date": (start_date + (end_date - start_date) * i / 15).isoformat(),
+            "student_info": synthetic_paragraph(rng),
+            "teacher_info": synthetic_paragraph(rng)
+        }
+        if rng.random() < defect_rate:
+            defects += 1
+            defect = rng.choice(("short", "duplicate", "date", "format") if i else ("short", "date", "format"))
+            if defect == "format":
+                consultation["teacher_info"] = [sentence + "。" for sentence in consultation["teacher_info"].split("。") if sentence]
+            elif defect == "short":
+                consultation["student_info"] = synthetic_paragraph(rng, 20, 40)
+            elif defect == "duplicate":
+                consultation["student_info"] = consultations[-1]["student_info"]
+            else:
+                consultation["date"] = (end_date + timedelta(days=30)).isoformat()
+        consultations.append(consultation)
+    content = {
+        "consultations": consultations,
+        "work_summary": synthetic_paragraph(rng, 200, 260),
+        "mid_term_review": synthetic_paragraph(rng, 150, 200)
+    }
+    return content, defects
+
+def _regenerated_content(rng, prompt, defect_rate=0.0):
+    """只返回提示词中列出的需要重新生成的条目，按 defect_rate 的概率仍然字数不足"""
+    items = prompt.split("需要重新生成的内容", 1)[-1].split("输出格式", 1)[0]
+    content = {"consultations": []}
+    defects = 0
+    for line in items.splitlines():
+        match = re.search(r"第(\d+)次咨询", line)
+        if match:
+            dates = [date.fromisoformat(value) for value in _DATE.findall(line)[:2]]
+            consultation = {
+                "index": int(match.group(1)),
+                "date": (dates[0] + (dates[1] - dates[0]) / 2).isoformat() if len(dates) == 2 else "",
+                "student_info": synthetic_paragraph(rng),
+                "teacher_info": synthetic_paragraph(rng)
+            }
+            if rng.random() < defect_rate:
+                defects += 1
+                consultation["student_info"] = synthetic_paragraph(rng, 20, 40)
+            content["consultations"].append(consultation)
+        elif "工作总结" in line:
+            content["work_summary"] = synthetic_paragraph(rng, 200, 260)
+        elif "中期检查评价" in line:
+            content["mid_term_review"] = synthetic_paragraph(rng, 150, 200)
+    return content, defects
+
+class MockLLMServer:
+    """容量随时间下降的模拟服务，可在后台线程中运行"""
+
+    def __init__(self, port=0, capacities=(12, 6, 3), phase_seconds=60.0, base_latency=2.0, addr="127.0.0.1",
+                 defect_rate=0.0, seed=None, retry_after=None):
+        self.capacities = list(capacities)
+        self.phase_seconds = phase_seconds
+        self.base_latency = base_latency
+        self.defect_rate = defect_rate
+        # 返回429时附带的 Retry-After（秒），为空时不附带
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.stats = {"ok": 0, "rate_limited": 0, "regenerations": 0, "defects": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._started = None
+        self._server = ThreadingHTTPServer((addr, port), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://{addr}:{self._server.server_address[1]}"
+
+    def capacity(self):
+        """当前阶段的容量（第一个请求到达时开始计时）"""
+        if self._started is None:
+            return self.capacities[0]
+        phase = int((time.monotonic() - self._started) / self.phase_seconds)
+        return self.capacities[min(phase, len(self.capacities) - 1)]
+
+    def _admit(self):
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+            capacity = self.capacity()
+            if self.in_flight >= capacity:
+                self.stats["rate_limited"] += 1
+                return None
+            self.in_flight += 1
+            return self.in_flight / capacity
+
+    def _finish(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.stats["ok"] += 1
+
+    def _content(self, prompt):
+        """按提示词类型生成返回内容"""
+        with self._lock:
+            if "需要重新生成的内容" in prompt:
+                self.stats["regenerations"] += 1
+                content, defects = _regenerated_content(self._rng, prompt, self.defect_rate)
+            elif '"consultations"' in prompt:
+                content, defects = _consultation_content(self._rng, prompt, self.defect_rate)
+            else:
+                content, defects = _task_content(self._rng), 0
+            self.stats["defects"] += defects
+        return json.dumps(content, ensure_ascii=False)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with server._lock:
+                    self._send_json(200, {**server.stats, "in_flight": server.in_flight, "capacity": server.capacity()})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                prompt = "".join(message["content"] for message in request.get("messages", []))
+                load = server._admit()
+                if load is None:
+                    headers = {"Retry-After": str(server.retry_after)} if server.retry_after is not None else None
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, headers)
+                    return
+                try:
+                    is_consultation = '"consultations"' in prompt
+                    latency = server.base_latency * (1 + load) * random.uniform(0.8, 1.2)
+                    if is_consultation:
+                        latency *= CONSULTATION_LATENCY_FACTOR
+                    time.sleep(latency)
+                    content = server._content(prompt)
+                finally:
+                    server._finish()
+                self._send_json(200, {
+                    "id": "mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(content), "total_tokens": len(prompt) + len(content)}
+                })
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """在后台线程中运行"""
+        threading.Thread(target=self.serve_forever, name="mock-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟容量逐步下降的大模型服务")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--capacity", nargs="+", type=int, default=[12, 6, 3], help="各阶段的容量（同时处理的请求数）")
+    parser.add_argument("--phase-seconds", type=float, default=60.0, help="每个阶段的持续时间（秒）")
+    parser.add_argument("--latency", type=float, default=2.0, help="空闲时生成任务书的延迟（秒）")
+    parser.add_argument("--defect-rate", type=float, default=0.0, help="每条咨询记录出现问题的概率")
+    parser.add_argument("--retry-after", type=float, help="返回429时附带的 Retry-After（秒）")
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        args.port, args.capacity, args.phase_seconds, args.latency, defect_rate=args.defect_rate, retry_after=args.retry_after
+    )
+    print(f"模拟服务已启动：{server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""使用本地 LibreOffice 将渲染好的 .docx 批量转换为 PDF"""
+import os
+import pathlib
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from document_cache import atomic_move
+
+# 每次启动 LibreOffice 最多转换的文档数
+DEFAULT_CHUNK_SIZE = 20
+# 检查转换进度的间隔（秒）
+POLL_INTERVAL = 0.2
+
+def find_converter():
+    """查找 LibreOffice 可执行文件，找不到时返回None"""
+    for name in ("soffice", "libreoffice"):
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+def is_complete_pdf(path):
+    """文件是否为完整的PDF（结尾有 %%EOF 标记），用于跳过之前中断时留下的不完整文件"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(max(os.path.getsize(path) - 1024, 0))
+            return b"%%EOF" in f.read()
+    except OSError:
+        return False
+
+class PdfConverter:
+    """并发数有上限的 LibreOffice 转换池
+
+    每个工作线程使用独立的 LibreOffice 用户配置目录，并一次把排队中的多个文档
+    （最多 chunk_size 个）交给同一个 soffice 进程转换：启动进程和加载配置的开销由多个文件分摊，
+    渲染比转换快时排队的文档越多，每次转换的文档也越多。
+    """
+
+    def __init__(self, max_workers=2, soffice_path=None, timeout=120, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.soffice_path = soffice_path or find_converter()
+        if not self.soffice_path:
+            raise RuntimeError("未找到 LibreOffice（soffice），无法导出PDF。")
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.work_dir = tempfile.mkdtemp(prefix="pdf_export_")
+        self._jobs = queue.Queue()
+        self._workers = [
+            threading.Thread(
+                target=self._work,
+                args=(pathlib.Path(self.work_dir, f"profile_{i}").as_uri(),),
+                name=f"pdf-export-{i}",
+                daemon=True
+            )
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _next_chunk(self):
+        """等待下一个任务，并取出此时已在排队的其他任务；关闭后返回空列表"""
+        job = self._jobs.get()
+        chunk = []
+        while job is not None:
+            chunk.append(job)
+            if len(chunk) >= self.chunk_size:
+                break
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+        if job is None:
+            # 关闭标记留给其他工作线程
+            self._jobs.put(None)
+        return chunk
+
+    def _work(self, profile_uri):
+        while True:
+            chunk = self._next_chunk()
+            if not chunk:
+                return
+            jobs = [job for job in chunk if job[2].set_running_or_notify_cancel()]
+            if jobs:
+                self._convert(profile_uri, jobs)
+
+    def _run(self, profile_uri, inputs, out_dir):
+        """用一个 soffice 进程转换 inputs，返回 (每个文件的转换耗时（未转换的为None）, 错误信息)
+
+        soffice 按顺序逐个转换，超时按单个文档计算：连续 timeout 秒没有新的PDF生成时结束进程。
+        每个文件的耗时为其PDF与上一个PDF的生成时间之差，第一个文件包含启动 soffice 的时间。
+        """
+        started = time.time()
+        outputs = [os.path.join(out_dir, pathlib.Path(path).stem + ".pdf") for path in inputs]
+        with tempfile.TemporaryFile(dir=self.work_dir) as stderr:
+            process = subprocess.Popen(
+                [
+                    self.soffice_path,
+                    f"-env:UserInstallation={profile_uri}",
+                    "--headless", "--norestore",
+                    "--convert-to", "pdf",
+                    "--outdir", out_dir,
+                    *inputs
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=stderr
+            )
+            done = 0
+            last_progress = time.monotonic()
+            timed_out = False
+            while process.poll() is None:
+                time.sleep(POLL_INTERVAL)
+                while done < len(outputs) and os.path.exists(outputs[done]):
+                    done += 1
+                    last_progress = time.monotonic()
+                if time.monotonic() - last_progress > self.timeout:
+                    process.kill()
+                    process.wait()
+                    timed_out = True
+                    break
+            stderr.seek(0)
+            message = stderr.read().decode(errors="replace").strip()
+
+        if timed_out:
+            message = f"超过 {self.timeout} 秒没有完成"
+        elif not message:
+            message = f"退出码 {process.returncode}"
+        seconds = []
+        previous = started
+        for output in outputs:
+            # 进程被结束时正在写入的文件不完整
+            if not is_complete_pdf(output):
+                seconds.append(None)
+                continue
+            finished = os.path.getmtime(output)
+            seconds.append(max(finished - previous, 0.0))
+            previous = max(previous, finished)
+        return seconds, message
+
+    def _convert(self, profile_uri, jobs):
+        in_dir = tempfile.mkdtemp(dir=self.work_dir)
+        out_dir = tempfile.mkdtemp(dir=self.work_dir)
+        retry = []
+        try:
+            # 按序号命名输入文件，输出文件不会因为文件名相同而互相覆盖
+            inputs = []
+            for i, (docx_path, _, _) in enumerate(jobs):
+                input_path = os.path.join(in_dir, f"{i}.docx")
+                try:
+                    os.link(docx_path, input_path)
+                except OSError:
+                    shutil.copyfile(docx_path, input_path)
+                inputs.append(input_path)
+
+            seconds, message = self._run(profile_uri, inputs, out_dir)
+
+            for i, (docx_path, pdf_path, future) in enumerate(jobs):
+                if seconds[i] is None:
+                    if len(jobs) > 1:
+                        # 一个文档出错或卡住时同批的其他文档也可能没有转换，逐个重新转换
+                        retry.append(jobs[i])
+                    else:
+                        future.set_exception(RuntimeError(f"PDF转换失败：{message}"))
+                    continue
+                try:
+                    # 输出目录和缓存目录可能不在同一文件系统，先复制到目标目录再替换，不会留下不完整的文件
+                    atomic_move(os.path.join(out_dir, f"{i}.pdf"), pdf_path)
+                except OSError as e:
+                    future.set_exception(e)
+                    continue
+                future.set_result((pdf_path, seconds[i]))
+        except Exception as e:
+            for _, _, future in jobs:
+                if not future.done():
+                    future.set_exception(e)
+            retry = []
+        finally:
+            shutil.rmtree(in_dir, ignore_errors=True)
+            shutil.rmtree(out_dir, ignore_errors=True)
+        for job in retry:
+            self._convert(profile_uri, [job])
+
+    def submit(self, docx_path, pdf_path):
+        """提交转换任务，返回 Future，结果为 (pdf_path, 转换耗时秒数)"""
+        future = Future()
+        self._jobs.put((docx_path, pdf_path, future))
+        return future
+
+    def close(self):
+        self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,100 @@
+"""离线对比不同生成配置的耗时、token用量和输出格式有效率
+
+用法：
+    python profile_benchmark.py template.csv --profiles 标准 精简 --repeat 2
+
+需要在 .streamlit/secrets.toml 中配置 DEEPSEEK_API_KEY。
+"""
+import argparse
+import statistics
+import pandas as pd
+from student_consultation_app import (
+    generate_task_description,
+    generate_all_ai_content,
+    format_task_part,
+    build_task_description,
+    GENERATION_PROFILES
+)
+# 与批量生成使用同一套检查：能否缓存和渲染由 is_well_formed 决定
+from content_validator import validate_task_content, is_well_formed
+
+def run_profile(rows, profile, repeat):
+    """用指定配置为每个学生生成一遍内容，返回调用记录和格式检查结果"""
+    usage_log = []
+    results = {"generate_task_description": [], "generate_all_ai_content": []}
+
+    for _ in range(repeat):
+        for _, row in rows.iterrows():
+            start_date = pd.to_datetime(row["开始日期"]).date()
+            end_date = pd.to_datetime(row["结束日期"]).date()
+            additional_info = row.get("补充信息", "")
+
+            try:
+                task_content = generate_task_description(
+                    row["论文题目"], row["专业"], start_date, end_date,
+                    additional_info, profile, usage_log
+                )
+            except Exception as e:
+                print(f"[{profile}] {row['学生姓名']} 任务书生成失败：{e}")
+                results["generate_task_description"].append(False)
+                continue
+            results["generate_task_description"].append(not validate_task_content(task_content))
+
+            formatted_task_content = {key: format_task_part(value) for key, value in task_content.items()}
+            try:
+                ai_content = generate_all_ai_content(
+                    build_task_description(formatted_task_content, profile),
+                    start_date, end_date, row["论文题目"], row["学生姓名"],
+                    additional_info, profile, usage_log
+                )
+            except Exception as e:
+                print(f"[{profile}] {row['学生姓名']} 咨询内容生成失败：{e}")
+                results["generate_all_ai_content"].append(False)
+                continue
+            results["generate_all_ai_content"].append(is_well_formed(task_content, ai_content))
+
+    return usage_log, results
+
+def summarize(profile, usage_log, results):
+    """按阶段汇总一个配置的统计结果"""
+    lines = []
+    for stage, checks in results.items():
+        calls = [item for item in usage_log if item["stage"] == stage]
+        if not checks:
+            continue
+        latencies = [item["latency"] for item in calls] or [0.0]
+        lines.append(
+            f"{profile:<6}{stage:<28}"
+            f"{len(checks):>6}"
+            f"{statistics.mean(latencies):>10.1f}"
+            f"{max(latencies):>10.1f}"
+            f"{statistics.mean([item['prompt_tokens'] for item in calls] or [0]):>10.0f}"
+            f"{statistics.mean([item['completion_tokens'] for item in calls] or [0]):>10.0f}"
+            f"{sum(checks) / len(checks):>10.0%}"
+        )
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="对比不同生成配置的耗时、token用量和输出格式有效率")
+    parser.add_argument("sheet", help="学生信息表（.csv 或 .xlsx）")
+    parser.add_argument("--profiles", nargs="+", default=list(GENERATION_PROFILES), choices=list(GENERATION_PROFILES))
+    parser.add_argument("--repeat", type=int, default=1, help="每个学生重复生成的次数")
+    args = parser.parse_args()
+
+    if args.sheet.endswith(".csv"):
+        rows = pd.read_csv(args.sheet, dtype=str).fillna("")
+    else:
+        rows = pd.read_excel(args.sheet, dtype=str).fillna("")
+
+    report = [
+        f"{'配置':<6}{'阶段':<28}{'次数':>6}{'平均耗时':>10}{'最大耗时':>10}"
+        f"{'输入token':>10}{'输出token':>10}{'有效率':>10}"
+    ]
+    for profile in args.profiles:
+        usage_log, results = run_profile(rows, profile, args.repeat)
+        report.extend(summarize(profile, usage_log, results))
+
+    print("\n".join(report))
+
+if __name__ == "__main__":
+    main()
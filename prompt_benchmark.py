@@ -0,0 +1,112 @@
+"""统计每个学生构造提示词的耗时和token数（不调用大模型）
+
+用法：
+    python prompt_benchmark.py template.csv --profile 精简 --repeat 200
+
+咨询内容的提示词需要任务书描述，这里使用与真实输出长度相近的合成内容。
+"""
+import argparse
+import statistics
+import time
+import pandas as pd
+from generation_profiles import (
+    build_task_messages,
+    build_consultation_messages,
+    build_task_description,
+    get_generation_profile,
+    GENERATION_PROFILES,
+    DEFAULT_PROFILE
+)
+from prompt_templates import prompt_hash, sanitize
+from batch_planner import estimate_message_tokens
+from memory_benchmark import synthetic_record
+
+def build_seconds(build, repeat):
+    """多次构造取中位数，减少计时抖动"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        build()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def truncated_fields(template, values):
+    """超出长度上限被截断的字段"""
+    truncated = []
+    for name, field in template.fields.items():
+        text = sanitize(values[name], field)
+        if len(text) == field.max_chars and text.endswith("…"):
+            truncated.append(name)
+    return truncated
+
+def main():
+    parser = argparse.ArgumentParser(description="统计每个学生构造提示词的耗时和token数")
+    parser.add_argument("sheet", nargs="?", default="template.csv", help="学生信息表（.csv 或 .xlsx）")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, choices=list(GENERATION_PROFILES))
+    parser.add_argument("--repeat", type=int, default=100, help="每个提示词重复构造的次数")
+    args = parser.parse_args()
+
+    if args.sheet.endswith(".csv"):
+        rows = pd.read_csv(args.sheet, dtype=str).fillna("")
+    else:
+        rows = pd.read_excel(args.sheet, dtype=str).fillna("")
+
+    generation_profile = get_generation_profile(args.profile)
+    task_template = generation_profile["task"]["template"]
+    consultation_template = generation_profile["consultation"]["template"]
+    print(f"模板：{task_template.id}（{task_template.fingerprint}），{consultation_template.id}（{consultation_template.fingerprint}）")
+    print(
+        f"{'学生姓名':<10}{'任务书(微秒)':>12}{'任务书token':>12}{'咨询(微秒)':>12}{'咨询token':>12}"
+        f"  {'任务书提示词哈希':<10}{'咨询提示词哈希':<11}截断字段"
+    )
+    totals = {"task_seconds": [], "task_tokens": [], "consultation_seconds": [], "consultation_tokens": []}
+    for i, (_, row) in enumerate(rows.iterrows()):
+        start_date = pd.to_datetime(row["开始日期"]).date()
+        end_date = pd.to_datetime(row["结束日期"]).date()
+        additional_info = row.get("补充信息", "")
+        task_description = build_task_description(synthetic_record(i)["task_content"], args.profile)
+
+        def build_task():
+            return build_task_messages(row["论文题目"], row["专业"], start_date, end_date, additional_info, args.profile)
+
+        def build_consultation():
+            return build_consultation_messages(task_description, start_date, end_date, row["论文题目"], additional_info, args.profile)
+
+        task_seconds = build_seconds(build_task, args.repeat)
+        consultation_seconds = build_seconds(build_consultation, args.repeat)
+        task_tokens = estimate_message_tokens(build_task())
+        consultation_tokens = estimate_message_tokens(build_consultation())
+        # 分别检查两个提示词，咨询内容的任务书描述也有长度上限
+        truncated = [f"任务书.{name}" for name in truncated_fields(task_template, {
+            "title": row["论文题目"], "major": row["专业"], "additional_info": additional_info
+        })] + [f"咨询.{name}" for name in truncated_fields(consultation_template, {
+            "title": row["论文题目"],
+            "task_description": task_description,
+            "additional_info": additional_info,
+            "start_date": start_date.strftime('%Y-%m-%d'),
+            "end_date": end_date.strftime('%Y-%m-%d')
+        })]
+        # 与调用记录中的哈希计算方式相同（包含模型和输出上限），可据此在用量记录中查找
+        task_hash = prompt_hash(build_task(), generation_profile["task"]["model"], generation_profile["task"]["max_tokens"])
+        consultation_hash = prompt_hash(
+            build_consultation(), generation_profile["consultation"]["model"], generation_profile["consultation"]["max_tokens"]
+        )
+
+        totals["task_seconds"].append(task_seconds)
+        totals["task_tokens"].append(task_tokens)
+        totals["consultation_seconds"].append(consultation_seconds)
+        totals["consultation_tokens"].append(consultation_tokens)
+        print(
+            f"{row['学生姓名']:<10}{task_seconds * 1e6:>12.1f}{task_tokens:>12}"
+            f"{consultation_seconds * 1e6:>12.1f}{consultation_tokens:>12}"
+            f"  {task_hash[:12]:<14}{consultation_hash[:12]:<14}{'、'.join(truncated)}"
+        )
+
+    if totals["task_tokens"]:
+        print(
+            f"{'平均':<10}{statistics.mean(totals['task_seconds']) * 1e6:>12.1f}{statistics.mean(totals['task_tokens']):>12.0f}"
+            f"{statistics.mean(totals['consultation_seconds']) * 1e6:>12.1f}{statistics.mean(totals['consultation_tokens']):>12.0f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+"""提示词模板：模块加载时编译一次，填入的字段按字段限制长度并清理
+
+模板中用 ${字段名} 表示占位符，其余文字（包括JSON示例中的花括号）原样保留；填入的值只做一次拼接，
+不会再被当作格式字符串解析，因此补充信息中的花括号等字符不会破坏提示词。
+修改模板内容时请同时增加版本号，已缓存的生成内容会随模板指纹变化而失效。
+"""
+import math
+import re
+import textwrap
+from document_cache import hash_json
+
+_PLACEHOLDER = re.compile(r"\$\{(\w+)\}")
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+class PromptField:
+    """模板字段：max_chars 为最多保留的字数，single_line 为真时合并为一行"""
+
+    def __init__(self, max_chars, single_line=False):
+        self.max_chars = max_chars
+        self.single_line = single_line
+
+def sanitize(value, field):
+    """清理填入提示词的值：去掉控制字符，花括号换成全角，超出长度时截断"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    text = str(value).replace("\r\n", "\n").replace("\r", "\n")
+    text = _CONTROL_CHARS.sub("", text)
+    # 避免与提示词中的JSON示例混淆
+    text = text.replace("{", "｛").replace("}", "｝")
+    if field.single_line:
+        text = " ".join(text.split())
+    else:
+        text = _BLANK_LINES.sub("\n\n", text.strip())
+    if len(text) > field.max_chars:
+        text = text[:field.max_chars - 1] + "…"
+    return text
+
+class PromptTemplate:
+    """编译后的提示词模板"""
+
+    def __init__(self, name, version, system, user, fields):
+        self.name = name
+        self.version = version
+        self.fields = fields
+        self.system = textwrap.dedent(system).strip()
+        self.user = user
+        # 偶数位置为固定文字，奇数位置为字段名
+        self._segments = _PLACEHOLDER.split(self.system)
+        placeholders = set(self._segments[1::2])
+        if placeholders != set(fields):
+            raise ValueError(f"模板 {name} 的占位符与字段定义不一致：{sorted(placeholders ^ set(fields))}")
+        self.fingerprint = hash_json({"name": name, "version": version, "system": self.system, "user": user})[:16]
+
+    @property
+    def id(self):
+        return f"{self.name}@v{self.version}"
+
+    def render(self, **values):
+        """填入字段，返回 messages 列表"""
+        if set(values) != set(self.fields):
+            raise ValueError(f"模板 {self.name} 的字段不匹配：{sorted(set(values) ^ set(self.fields))}")
+        clean = {name: sanitize(values[name], field) for name, field in self.fields.items()}
+        parts = list(self._segments)
+        parts[1::2] = [clean[name] for name in self._segments[1::2]]
+        return [
+            {"role": "system", "content": "".join(parts)},
+            {"role": "user", "content": self.user}
+        ]
+
+def prompt_hash(messages, model=None, max_tokens=None):
+    """提示词的确定性哈希：模型、参数和提示词相同时结果相同，用于缓存和调用记录"""
+    return hash_json({"model": model, "max_tokens": max_tokens, "messages": messages})
+
+# 字段长度上限（字数）
+TITLE_FIELD = PromptField(200, single_line=True)
+MAJOR_FIELD = PromptField(50, single_line=True)
+DATE_FIELD = PromptField(10, single_line=True)
+ADDITIONAL_INFO_FIELD = PromptField(500)
+TASK_DESCRIPTION_FIELD = PromptField(6000)
+REGENERATION_ITEMS_FIELD = PromptField(4000)
+
+TASK_PROMPT = PromptTemplate(
+    "task_description",
+    1,
+    """
+    请根据给定的论文题目、专业、时间范围和补充信息，生成一份详细的毕业论文任务书描述。描述应包括以下5个部分，并以JSON格式输出：
+
+    论文题目：${title}
+    专业：${major}
+    补充信息：${additional_info}
+
+    1. 课题的任务内容：
+       - 须融入论文选题内容，不少于100字
+       - 阐述选题的研究背景和现实意义
+       - 明确研究目标和预期成果
+       - 说明研究的创新点和应用价值
+       - 指出研究的重点和难点
+       - 说明研究的理论和实践意义
+       - 阐述研究的可行性分析
+
+    2. 原始条件及数据：
+       - 说明完成论文所需的基础知识和技能要求
+       - 列出必要的软硬件环境和工具
+       - 明确数据来源和获取方式
+       - 说明数据的类型和规模
+       - 规定数据的质量要求
+       - 说明数据的预处理方法
+       - 规定数据的存储和管理方式
+
+    3. 设计的技术要求（论文的研究要求）：
+       - 详细说明研究方法和技术路线
+       - 提出具体的技术指标和参数要求
+       - 规定实验或调研的具体要求
+       - 明确数据处理和分析方法
+       - 提出创新性要求和技术突破点
+       - 说明研究的可验证性
+       - 规定研究结果的评价标准
+
+    4. 毕业设计（论文）应完成的具体工作：
+       A. 基本要求（通用部分）：
+          1. 文献综述和开题报告：
+             - 开题报告成绩要求70分以上合格
+             - 文献综述字数2500字左右
+             - 开题报告需包含研究计划和预期目标
+          2. 外文翻译：
+             - 翻译一篇与选题相关的英文文献
+             - 字数要求20000英文印刷字符以上
+             - 翻译质量要准确、通顺
+          3. 调研工作：
+             - 进行实地调研或实验研究
+             - 调研报告字数3000字左右
+             - 需包含数据分析和结果讨论
+          4. 论文撰写：
+             - 论文总字数1.5~2万字
+             - 符合学校论文格式规范
+             - 完成导师要求的修改
+          5. 论文答辩：
+             - 准备答辩PPT和讲稿
+             - 参加答辩并回答问题
+             - 总分60分以上为通过
+
+       B. 研究工作（根据论文题目"${title}"和专业"${major}"生成具体内容）：
+          1. 理论研究部分：
+             - 系统梳理本研究领域的理论基础
+             - 构建适合研究问题的理论框架
+             - 提出研究假设或理论模型
+             - 确定关键变量和影响因素
+          2. 研究方法部分：
+             - 设计详细的研究方案
+             - 确定研究方法和技术路线
+             - 制定数据收集和分析计划
+             - 建立评估指标体系
+          3. 实验/调研部分：
+             - 开展实验或调研工作
+             - 收集和整理原始数据
+             - 进行数据预处理和分析
+             - 验证研究假设
+          4. 创新工作部分：
+             - 提出创新性的解决方案
+             - 设计和实施对比实验
+             - 总结研究的创新点
+             - 验证创新成果的有效性
+          5. 应用研究部分：
+             - 选择典型案例进行分析
+             - 进行实践应用验证
+             - 评估应用效果
+             - 总结实践价值和推广意义
+
+    5. 资料文献要求及主要的参考文献：
+       - 文献数量要求：
+         * 外文文献不少于4篇
+         * 中文文献不少于16篇
+         * 核心期刊文献占比不低于50%
+       - 文献时效性要求：
+         * 近五年文献占比不少于50%
+         * 需包含最新研究进展
+       - 文献搜索途径：
+         * 外文数据库：Web of Science、Scopus、IEEE Xplore等
+         * 中文数据库：CNKI、万方、维普等
+         * 学术搜索引擎：Google Scholar、百度学术等
+       - 文献类型要求：
+         * 以学术期刊论文为主
+         * 必须包含核心期刊文献
+         * 可包含高水平会议论文
+         * 可包含优秀博硕士论文
+       - 文献引用规范：
+         * 遵守学术规范
+         * 注意避免过度引用
+         * 引用格式符合要求
+       - 建议关键词：根据论文主题提供5-8个核心关键词
+       - 推荐经典文献：列出3-5篇该领域的经典或高被引文献
+
+    请确保生成的内容：
+    1. 专业性：使用专业术语和表达方式
+    2. 针对性：内容与论文题目和专业紧密相关
+    3. 可操作性：要求具体明确，便于执行
+    4. 完整性：覆盖论文写作的各个环节
+    5. 规范性：符合学术规范和学校要求
+    6. 总字数：控制在1000字左右
+
+    请生成一个JSON格式的输出，每个部分作为一个单独的字段。对于每个字段，如果内容包含多个要点，请使用数组格式，每个要点作为数组的一个元素。
+
+    输出的JSON格式示例：
+    {
+        "task_content": [
+            "1. 研究背景：...(详细阐述选题背景和意义，不少于100字)",
+            "2. 研究目标：...(明确具体的研究目标)",
+            "3. 创新点：...(说明研究的创新之处)",
+            "4. 研究重点和难点：...(指出关键问题)",
+            "5. 理论和实践意义：...(阐述研究价值)",
+            "6. 可行性分析：...(说明研究的可行性)"
+        ],
+        "original_conditions": [
+            "1. 基础知识要求：...(列出必备知识)",
+            "2. 环境和工具要求：...(说明所需环境)",
+            "3. 数据来源：...(明确数据来源)",
+            "4. 数据类型：...(说明数据类型)",
+            "5. 数据规模：...(规定数据规模)",
+            "6. 数据质量：...(说明质量要求)",
+            "7. 数据管理：...(规定管理方式)"
+        ],
+        "technical_requirements": [
+            "1. 研究方法：...(详述研究方法)",
+            "2. 技术指标：...(列出具体指标)",
+            "3. 实验要求：...(说明实验规范)",
+            "4. 数据分析方法：...(规定分析方法)",
+            "5. 创新性要求：...(提出创新要求)",
+            "6. 可验证性：...(说明验证方法)",
+            "7. 评价标准：...(规定评价标准)"
+        ],
+        "specific_work": [
+            "A. 基本要求（通用部分）：",
+            "1. 文献综述和开题报告：",
+            "   - 开题报告成绩要求70分以上合格",
+            "   - 文献综述字数2500字左右",
+            "   - 开题报告需包含研究计划和预期目标",
+            "2. 外文翻译：",
+            "   - 翻译一篇与选题相关的英文文献",
+            "   - 字数要求20000英文印刷字符以上",
+            "   - 翻译质量要准确、通顺",
+            "3. 调研工作：",
+            "   - 进行实地调研或实验研究",
+            "   - 调研报告字数3000字左右",
+            "   - 需包含数据分析和结果讨论",
+            "4. 论文撰写：",
+            "   - 论文总字数1.5~2万字",
+            "   - 符合学校论文格式规范",
+            "   - 完成导师要求的修改",
+            "5. 论文答辩：",
+            "   - 准备答辩PPT和讲稿",
+            "   - 参加答辩并回答问题",
+            "   - 总分60分以上为通过",
+            "",
+            "B. 研究工作（具体内容）：",
+            "1. 理论研究：[根据论文题目生成具体的理论研究任务]",
+            "2. 研究方法：[根据论文题目生成具体的研究方法]",
+            "3. 实验/调研：[根据论文题目生成具体的实验或调研任务]",
+            "4. 创新工作：[根据论文题目生成具体的创新任务]",
+            "5. 应用研究：[根据论文题目生成具体的应用研究任务]"
+        ],
+        "reference_requirements": [
+            "1. 文献数量和类型要求：",
+            "   - 外文文献不少于4篇",
+            "   - 中文文献不少于16篇",
+            "   - 核心期刊文献占比不低于50%",
+            "2. 文献时效性要求：",
+            "   - 近五年文献占比不少于50%",
+            "   - 需包含最新研究进展",
+            "3. 文献搜索途径：",
+            "   - 外文数据库：Web of Science、Scopus、IEEE Xplore等",
+            "   - 中文数据库：CNKI、万方、维普等",
+            "   - 学术搜索引擎：Google Scholar、百度学术等",
+            "4. 文献引用规范：",
+            "   - 遵守学术规范",
+            "   - 注意避免过度引用",
+            "   - 引用格式符合要求",
+            "5. 建议关键词：[与论文主题相关的5-8个关键词]",
+            "6. 推荐经典文献：[3-5篇该领域的经典或高被引文献]"
+        ]
+    }
+    """,
+    "请根据给定的论文题目和专业生成一个JSON格式的任务书描述。",
+    {
+        "title": TITLE_FIELD,
+        "major": MAJOR_FIELD,
+        "additional_info": ADDITIONAL_INFO_FIELD
+    }
+)
+
+CONSULTATION_PROMPT = PromptTemplate(
+    "consultation",
+    1,
+    """
+    根据以下论文任务书描述和补充信息，为16次学生论文咨询生成内容。每次咨询包括学生信息和教师信息，具体要求如下：
+
+    基本要求：
+    1. 每条信息100-200字，确保内容充实且有实质性指导价值
+    2. 每条信息包含3-4个完整的句子
+    3. 内容具体详实，避免空泛表述，需包含具体的研究细节、方法和建议
+    4. 不要有称呼语，直接描述内容
+    5. 按照论文写作的进度逐步推进，体现研究的连续性和深入性
+    6. 每次咨询都要体现实质性进展，不能简单重复
+
+    内容要求：
+    1. 学生信息应包含：
+       - 当前工作的具体进展
+       - 遇到的具体问题或困难
+       - 已经采取的解决方案
+       - 下一步的工作计划
+
+    2. 教师信息应包含：
+       - 对学生工作的具体评价
+       - 针对性的改进建议
+       - 明确的指导方向
+       - 具体的技术或方法建议
+
+    3. 进度安排：
+       - 前5次咨询：选题定位、文献研究、方法设计阶段
+       - 中5次咨询：实验/调研实施、数据收集分析阶段
+       - 后6次咨询：论文撰写、修改完善阶段
+
+    论文信息：
+    论文题目：${title}
+    论文任务书描述：${task_description}
+    补充信息：${additional_info}
+
+    时间安排：
+    开始日期：${start_date}
+    结束日期：${end_date}
+
+    输出格式为JSON，包含以下字段：
+    1. consultations: 16个对象的数组，每个对象包含：
+       - date: 咨询日期
+       - student_info: 学生工作汇报（100-200字）
+       - teacher_info: 教师指导建议（100-200字）
+
+    2. work_summary: 200-300字的毕业论文工作总结，包含：
+       - 总结学生的工作态度和表现
+       - 评价研究工作的创新性和价值
+       - 对论文质量的整体评价
+       - 对学生的期望和建议
+
+    3. mid_term_review: 150-200字的中期检查评价，包含：
+       - 前期工作的具体评价
+       - 已取得的阶段性成果
+       - 存在的问题和不足
+       - 后工作的具体要求和建议
+
+    示例输出格式：
+    {
+        "consultations": [
+            {
+                "date": "2024-03-01",
+                "student_info": "完成了20篇核心期刊论文的系统阅读和分析，重点关注了深度学习在图像识别领域的最新进展。通过文献梳理，发现目前主要存在模型复杂度高和泛化能力不足两个问题。基于文献分析结果，初步构思了一个基于轻量级网络的改进方案，并完成了技术路线的初步设计。准备开始进行算法的详细设计和实验环境的搭建。",
+                "teacher_info": "文献综述工作比较系统，问题定位准确。建议进一步细化改进方案中的创新点，可以从模型结构优化和损失函数设计两个方向深入。同时要注意收集足够的实验数据，建议准备至少三个公开数据集进行验证。需要设计详细的对比实验方案，确保研究结果的可靠性和说服力。"
+            }
+        ],
+        "work_summary": "该生在毕业论文研究过程中表现出色，工作态度认真负责，科研能力突出。论文选题紧跟学科前沿，具有重要的理论意义和应用价值。在研究过程中，通过大量的文献阅读和实验探索，提出了具有创新性的解决方案。实验设计严谨，数据分析深入，研究结果可靠。特别值得肯定的是，该生善于思考，能够独立解决问题，具备良好的科研素养。论文质量较高，创新点明确，实验验证充分，具有较好的学术价值和应用前景。",
+        "mid_term_review": "前期工作扎实，文献综述全面且深入，研究方案设计合理可行。已完成关键算法的设计和初步实验，取得了积极的阶段性成果。存在的问题是实验验证还需要进一步深入，数据分析有待加强。建议在后期工作中重点加强实验数据的分析深度，进一步突出研究的创新点，同时注意论文结构的逻辑性和完整性。要按计划推进实验工作，确保留出充足的论文修改时间。"
+    }
+    """,
+    "请根据给定的论文题目和专业生成一个JSON格式的任务书描述。",
+    {
+        "title": TITLE_FIELD,
+        "task_description": TASK_DESCRIPTION_FIELD,
+        "additional_info": ADDITIONAL_INFO_FIELD,
+        "start_date": DATE_FIELD,
+        "end_date": DATE_FIELD
+    }
+)
+
+# “精简”配置使用的提示词：条目数和字数要求更少，输出能在较小的 max_tokens 内完整返回
+TASK_PROMPT_COMPACT = PromptTemplate(
+    "task_description_compact",
+    1,
+    """
+    请根据给定的论文题目、专业和补充信息，生成一份简明的毕业论文任务书描述，以JSON格式输出。
+
+    论文题目：${title}
+    专业：${major}
+    补充信息：${additional_info}
+
+    包含以下5个字段，每个字段为数组，每个要点作为数组的一个元素：
+    1. task_content（课题的任务内容）：研究背景和意义、研究目标、创新点、研究重点和难点，共4个要点，第一个要点不少于100字
+    2. original_conditions（原始条件及数据）：基础知识要求、软硬件环境、数据来源和规模，共3个要点
+    3. technical_requirements（设计的技术要求）：研究方法和技术路线、技术指标、数据分析方法、评价标准，共4个要点
+    4. specific_work（应完成的具体工作）：先列出以下5项基本要求，再根据论文题目"${title}"列出3项具体的研究工作
+       - 文献综述2500字左右，开题报告成绩70分以上合格
+       - 翻译一篇与选题相关的英文文献，20000英文印刷字符以上
+       - 调研报告3000字左右，包含数据分析和结果讨论
+       - 论文总字数1.5~2万字，符合学校论文格式规范
+       - 参加答辩，总分60分以上为通过
+    5. reference_requirements（资料文献要求）：外文文献不少于4篇、中文文献不少于16篇、近五年文献占比不少于50%，
+       以及5-8个建议关键词，共3个要点
+
+    要求：内容专业、具体，与论文题目和专业紧密相关；除第一个要点外每个要点不超过60字，总字数控制在600字左右。
+
+    输出的JSON格式示例：
+    {
+        "task_content": ["1. 研究背景：...", "2. 研究目标：...", "3. 创新点：...", "4. 研究重点和难点：..."],
+        "original_conditions": ["1. 基础知识要求：...", "2. 环境和工具要求：...", "3. 数据来源和规模：..."],
+        "technical_requirements": ["1. 研究方法：...", "2. 技术指标：...", "3. 数据分析方法：...", "4. 评价标准：..."],
+        "specific_work": ["1. 文献综述和开题报告：...", "...", "6. 理论研究：...", "7. 实验/调研：...", "8. 应用研究：..."],
+        "reference_requirements": ["1. 文献数量要求：...", "2. 文献时效性要求：...", "3. 建议关键词：..."]
+    }
+    """,
+    "请根据给定的论文题目和专业生成一个JSON格式的任务书描述。",
+    {
+        "title": TITLE_FIELD,
+        "major": MAJOR_FIELD,
+        "additional_info": ADDITIONAL_INFO_FIELD
+    }
+)
+
+CONSULTATION_PROMPT_COMPACT = PromptTemplate(
+    "consultation_compact",
+    1,
+    """
+    根据以下论文任务书描述和补充信息，为16次学生论文咨询生成内容。每次咨询包括学生信息和教师信息，具体要求如下：
+
+    1. 每条信息100-150字，包含2-3个完整的句子，不要有称呼语，直接描述内容
+    2. 学生信息写当前进展、遇到的问题和下一步计划；教师信息写评价和具体的改进建议
+    3. 按论文写作的进度逐步推进，每次咨询都要体现实质性进展，不能简单重复：
+       前5次为选题、文献研究和方法设计，中5次为实验/调研和数据分析，后6次为论文撰写和修改完善
+
+    论文信息：
+    论文题目：${title}
+    论文任务书描述：${task_description}
+    补充信息：${additional_info}
+
+    时间安排：
+    开始日期：${start_date}
+    结束日期：${end_date}
+
+    输出格式为JSON，包含以下字段：
+    1. consultations: 16个对象的数组，每个对象包含 date（咨询日期，YYYY-MM-DD）、student_info、teacher_info
+    2. work_summary: 150-200字的毕业论文工作总结（工作态度、研究的创新性和价值、论文质量、期望和建议）
+    3. mid_term_review: 100-150字的中期检查评价（前期工作、阶段性成果、存在的问题、后期要求）
+
+    示例输出格式：
+    {
+        "consultations": [
+            {
+                "date": "2024-03-01",
+                "student_info": "完成了20篇核心期刊论文的阅读，梳理出模型复杂度高和泛化能力不足两个主要问题。基于文献分析初步构思了基于轻量级网络的改进方案，下一步将细化技术路线并搭建实验环境。",
+                "teacher_info": "文献综述比较系统，问题定位准确。建议从模型结构优化和损失函数设计两个方向细化创新点，并准备至少三个公开数据集，设计完整的对比实验方案。"
+            }
+        ],
+        "work_summary": "...",
+        "mid_term_review": "..."
+    }
+    """,
+    "请根据给定的论文信息生成JSON格式的咨询记录、工作总结和中期检查评价。",
+    {
+        "title": TITLE_FIELD,
+        "task_description": TASK_DESCRIPTION_FIELD,
+        "additional_info": ADDITIONAL_INFO_FIELD,
+        "start_date": DATE_FIELD,
+        "end_date": DATE_FIELD
+    }
+)
+
+REGENERATION_PROMPT = PromptTemplate(
+    "regeneration",
+    1,
+    """
+    以下是一份毕业论文咨询记录中未通过质量检查的部分，请只重新生成这些部分。
+
+    论文题目：${title}
+    论文任务书描述：${task_description}
+    补充信息：${additional_info}
+
+    时间安排：
+    开始日期：${start_date}
+    结束日期：${end_date}
+
+    要求：
+    1. 学生信息和教师信息每条100-200字，包含3-4个完整的句子，不要有称呼语
+    2. 日期格式为YYYY-MM-DD，在给定的日期范围内
+    3. 内容具体详实，与其他咨询记录不重复，体现该阶段的实质性进展
+
+    需要重新生成的内容及存在的问题：
+    ${items}
+
+    输出格式为JSON，只包含需要重新生成的字段：
+    {
+        "consultations": [
+            {"index": 咨询序号, "date": "YYYY-MM-DD", "student_info": "...", "teacher_info": "..."}
+        ],
+        "work_summary": "...",
+        "mid_term_review": "..."
+    }
+    """,
+    "请重新生成上述未通过检查的内容。",
+    {
+        "title": TITLE_FIELD,
+        "task_description": TASK_DESCRIPTION_FIELD,
+        "additional_info": ADDITIONAL_INFO_FIELD,
+        "start_date": DATE_FIELD,
+        "end_date": DATE_FIELD,
+        "items": REGENERATION_ITEMS_FIELD
+    }
+)
+
+PROMPT_TEMPLATES = (TASK_PROMPT, TASK_PROMPT_COMPACT, CONSULTATION_PROMPT, CONSULTATION_PROMPT_COMPACT, REGENERATION_PROMPT)
+
+def template_fingerprints():
+    """所有模板的指纹，模板变化时生成内容的缓存键随之变化"""
+    return {template.name: template.fingerprint for template in PROMPT_TEMPLATES}
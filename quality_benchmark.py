@@ -0,0 +1,162 @@
+"""检查质量检查的查重阈值和重新生成流程（不调用真实的大模型）
+
+用法：
+    python quality_benchmark.py --texts 200 --students 30 --defect-rate 0.1
+
+第一部分用合成的咨询记录检查查重：对同一段文字做不同程度的改动，统计同一学生内的两两比较
+（validate_ai_content）和跨学生的LSH索引（DuplicateIndex）分别能检出多少；不同文字之间统计误报。
+第二部分在本地模拟服务（见 mock_llm_server.py）上运行一批学生，模拟服务按 --defect-rate 的概率
+在咨询记录中加入字数不足、重复、日期错误和字段类型错误的问题，统计质量检查检出的问题和重新生成后剩余的问题。
+"""
+import argparse
+import random
+import statistics
+import time
+from openai import OpenAI
+import student_consultation_app
+from batch_generation_app import generate_contents
+from content_validator import (
+    DuplicateIndex,
+    QualityGate,
+    minhash,
+    similarity,
+    SHINGLE_SIZE,
+    DUPLICATE_THRESHOLD,
+    _IGNORED_CHARS
+)
+from memory_benchmark import synthetic_record
+from mock_llm_server import MockLLMServer, synthetic_paragraph
+
+_REPLACEMENT_CHARS = "研究设计系统实现分析数据模型算法优化测试结果方法技术应用平台功能需求性能评价论文实验"
+
+def shingles(text):
+    normalized = _IGNORED_CHARS.sub("", text)
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(max(len(normalized) - SHINGLE_SIZE + 1, 1))}
+
+def jaccard(a, b):
+    """按字符切片计算的实际 Jaccard 相似度"""
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+def replace_chars(rng, text, ratio):
+    chars = list(text)
+    for i in rng.sample(range(len(chars)), int(len(chars) * ratio)):
+        chars[i] = rng.choice(_REPLACEMENT_CHARS)
+    return "".join(chars)
+
+def sentences(text):
+    return [sentence + "。" for sentence in text.split("。") if sentence]
+
+def shuffle_sentences(rng, text):
+    parts = sentences(text)
+    rng.shuffle(parts)
+    return "".join(parts)
+
+def swap_sentence(rng, text):
+    """删掉一句，再加入一句新的"""
+    parts = sentences(text)
+    parts.pop(rng.randrange(len(parts)))
+    parts.insert(rng.randrange(len(parts) + 1), sentences(synthetic_paragraph(rng, 1, 60))[0])
+    return "".join(parts)
+
+# 改动方式 -> 生成改动后文字的函数
+EDITS = {
+    "原样重复": lambda rng, text: text,
+    "调换句子顺序": shuffle_sentences,
+    "替换5%的字": lambda rng, text: replace_chars(rng, text, 0.05),
+    "替换一句": swap_sentence,
+    "替换10%的字": lambda rng, text: replace_chars(rng, text, 0.10),
+    "替换30%的字": lambda rng, text: replace_chars(rng, text, 0.30),
+}
+
+def check_duplicates(count, seed):
+    """返回每种改动的统计和不同文字之间的误报统计"""
+    rng = random.Random(seed)
+    texts = [synthetic_paragraph(rng) for _ in range(count)]
+    signatures = [minhash(text) for text in texts]
+
+    index = DuplicateIndex()
+    for i, sig in enumerate(signatures):
+        index.add(f"学生{i}", "原文", sig)
+
+    rows = []
+    for name, edit in EDITS.items():
+        scores, pairwise, indexed = [], 0, 0
+        for i, text in enumerate(texts):
+            edited = edit(rng, text)
+            sig = minhash(edited)
+            scores.append(jaccard(text, edited))
+            pairwise += similarity(signatures[i], sig) >= DUPLICATE_THRESHOLD
+            indexed += any(owner == f"学生{i}" for owner, _, _ in index.query("查询", sig))
+        above = sum(score >= DUPLICATE_THRESHOLD for score in scores)
+        rows.append((name, statistics.mean(scores), above / count, pairwise / count, indexed / count))
+
+    # 不同文字两两比较
+    distinct_scores = []
+    false_pairwise = 0
+    for i in range(count):
+        for j in range(i + 1, count):
+            distinct_scores.append(jaccard(texts[i], texts[j]))
+            false_pairwise += similarity(signatures[i], signatures[j]) >= DUPLICATE_THRESHOLD
+    false_indexed = sum(len(index.query(f"学生{i}", sig)) for i, sig in enumerate(signatures)) // 2
+    return rows, {
+        "pairs": len(distinct_scores),
+        "mean": statistics.mean(distinct_scores),
+        "max": max(distinct_scores),
+        "pairwise": false_pairwise,
+        "indexed": false_indexed
+    }
+
+def check_regeneration(students, defect_rate, seed):
+    """在模拟服务上运行一批学生（开启质量检查），返回统计结果"""
+    server = MockLLMServer(capacities=[64], base_latency=0.01, defect_rate=defect_rate, seed=seed).start()
+    student_consultation_app.client = OpenAI(api_key="mock", base_url=server.url, max_retries=0)
+    gate = QualityGate()
+    usage_log = []
+    started = time.perf_counter()
+    try:
+        rows = (synthetic_record(i)["row"] for i in range(students))
+        failed = sum(1 for _, _, error in generate_contents(rows, 8, quality_gate=gate, usage_log=usage_log) if error)
+    finally:
+        server.stop()
+    return {
+        "seconds": time.perf_counter() - started,
+        "failed": failed,
+        "calls": len(usage_log),
+        "defects": server.stats["defects"],
+        "regeneration_calls": server.stats["regenerations"],
+        "initial_issues": sum(item["初始问题数"] for item in gate.report),
+        "regenerations": sum(item["重新生成次数"] for item in gate.report),
+        "remaining_issues": sum(item["剩余问题数"] for item in gate.report),
+        "students_with_issues": sum(1 for item in gate.report if item["剩余问题数"])
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="检查质量检查的查重阈值和重新生成流程")
+    parser.add_argument("--texts", type=int, default=200, help="查重检查使用的文字段数")
+    parser.add_argument("--students", type=int, default=30, help="重新生成检查的学生数")
+    parser.add_argument("--defect-rate", type=float, default=0.1, help="模拟服务中每条咨询记录出现问题的概率")
+    parser.add_argument("--seed", type=int, default=2024)
+    args = parser.parse_args()
+
+    rows, distinct = check_duplicates(args.texts, args.seed)
+    print(f"查重（阈值 {DUPLICATE_THRESHOLD:.0%}，{args.texts} 段文字）：")
+    print(f"{'改动方式':<12}{'实际相似度':>10}{'超过阈值':>10}{'两两比较检出':>12}{'LSH索引检出':>12}")
+    for name, score, above, pairwise, indexed in rows:
+        print(f"{name:<12}{score:>14.0%}{above:>13.0%}{pairwise:>16.0%}{indexed:>15.0%}")
+    print(
+        f"不同文字 {distinct['pairs']} 对：平均相似度 {distinct['mean']:.0%}，最高 {distinct['max']:.0%}，"
+        f"两两比较误报 {distinct['pairwise']} 对，LSH索引误报 {distinct['indexed']} 对"
+    )
+
+    result = check_regeneration(args.students, args.defect_rate, args.seed)
+    print(f"\n重新生成（{args.students} 个学生，每条咨询记录出现问题的概率 {args.defect_rate:.0%}）：")
+    print(
+        f"模拟服务加入问题 {result['defects']} 处，质量检查初始检出 {result['initial_issues']} 条；"
+        f"重新生成 {result['regenerations']} 次（调用大模型共 {result['calls']} 次），"
+        f"剩余问题 {result['remaining_issues']} 条（{result['students_with_issues']} 个学生），"
+        f"失败 {result['failed']} 个学生，耗时 {result['seconds']:.1f} 秒"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""生成内容的导出和导入（JSONL，每行一个学生），用于不调用大模型重新渲染文档"""
+import json
+import pandas as pd
+
+REPLAY_FORMAT_VERSION = 1
+REPLAY_FILENAME = "生成内容.jsonl"
+
+def _plain_row(row):
+    """将一行学生信息转换为可JSON序列化的字典"""
+    return {key: "" if pd.isna(value) else value for key, value in row.items()}
+
+def replay_line(row, task_content, ai_content):
+    """生成一个学生的导出记录（一行JSON）"""
+    record = {
+        "version": REPLAY_FORMAT_VERSION,
+        "row": _plain_row(row),
+        "task_content": task_content,
+        "ai_content": ai_content
+    }
+    return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+def _replay_lines(file):
+    file.seek(0)
+    for line_number, line in enumerate(file, 1):
+        line = line.decode("utf-8-sig")
+        if line.strip():
+            yield line_number, line
+
+def iter_replay_file(file):
+    """逐行读取导出的生成内容，每次返回一个学生的记录"""
+    for line_number, line in _replay_lines(file):
+        record = json.loads(line)
+        if record.get("version") != REPLAY_FORMAT_VERSION:
+            raise ValueError(f"第{line_number}行的格式版本不受支持：{record.get('version')}")
+        missing = [key for key in ("row", "task_content", "ai_content") if key not in record]
+        if missing:
+            raise ValueError(f"第{line_number}行缺少字段：{', '.join(missing)}")
+        yield record
+
+def count_replay_records(file):
+    """统计导出文件中的学生数"""
+    return sum(1 for _ in _replay_lines(file))
@@ -0,0 +1,23 @@
+"""读取部署配置：环境变量优先，其次为 .streamlit/secrets.toml，都没有时使用默认值
+
+只在需要时读取，导入本模块不会访问 secrets，没有配置文件时也不会报错（离线脚本可以直接使用）。
+"""
+import os
+import streamlit as st
+
+def get_setting(name, default=None):
+    """读取一项配置"""
+    if os.environ.get(name):
+        return os.environ[name]
+    try:
+        return st.secrets.get(name, default)
+    except FileNotFoundError:
+        # 没有 secrets.toml（StreamlitSecretNotFoundError 是 FileNotFoundError 的子类）
+        return default
+
+def get_int_setting(name, default=0):
+    """读取一项整数配置，无法解析时使用默认值"""
+    try:
+        return int(get_setting(name, default))
+    except (TypeError, ValueError):
+        return default
@@ -1,417 +1,414 @@
 import streamlit as st
 from docxtpl import DocxTemplate, RichText, InlineImage
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from docx.shared import Mm
 import io
 import base64
 import json
-from openai import OpenAI
-
-# 初始化OpenAI客户端
-client = OpenAI(
-    api_key=st.secrets["DEEPSEEK_API_KEY"],
-    base_url="https://api.deepseek.com",
+import random
+import threading
+import time
+from openai import OpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+import metrics
+from concurrency_control import AdaptiveConcurrency
+from prompt_templates import REGENERATION_PROMPT, prompt_hash
+from settings import get_setting, get_int_setting
+from generation_profiles import (
+    consultation_keywords,
+    TASK_PARTS,
+    DIGEST_KEYS,
+    GENERATION_STAGES,
+    GENERATION_PROFILES,
+    DEFAULT_PROFILE,
+    stage_model,
+    get_generation_profile,
+    format_task_part,
+    build_task_description,
+    build_task_messages,
+    build_consultation_messages
 )
 
+# OpenAI客户端在第一次调用大模型时创建，导入本模块时不读取API密钥；
+# 基准测试可以直接给 client 赋值，指向本地的模拟服务（见 mock_llm_server.py）
+client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """返回OpenAI客户端，第一次调用时根据配置创建（重试由 _chat_json 负责，以便统计重试次数）"""
+    global client
+    with _client_lock:
+        if client is None:
+            client = OpenAI(
+                api_key=get_setting("DEEPSEEK_API_KEY"),
+                base_url=get_setting("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
+                max_retries=0,
+            )
+    return client
+
+# 限流、超时等临时错误的最多重试次数和首次重试前的等待时间（秒），之后每次加倍；
+# 服务端返回 Retry-After 时按其等待（不超过 MAX_RETRY_AFTER 秒）。等待时间随机延长最多 RETRY_JITTER，
+# 同时被限流的多个线程不会在同一时刻重试
+MAX_RETRIES = 2
+RETRY_BACKOFF = 1.0
+MAX_RETRY_AFTER = 60.0
+RETRY_JITTER = 0.5
+RETRYABLE_ERRORS = {
+    RateLimitError: "rate_limit",
+    APITimeoutError: "timeout",
+    APIConnectionError: "connection",
+    InternalServerError: "server_error",
+}
+# 说明服务端容量不足、需要降低并发的错误
+OVERLOAD_REASONS = {"rate_limit", "timeout", "server_error"}
+# 输出被截断时加倍的输出上限：未指定 max_tokens 时 deepseek-chat 默认输出4096个token，最多8192个
+DEFAULT_OUTPUT_TOKENS = 4096
+MAX_OUTPUT_TOKENS = 8192
+
+class RateLimiter:
+    """每分钟请求数限制，所有会话共用（同一个API密钥的限额是共享的）"""
+
+    def __init__(self, requests_per_minute=None):
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+        self.set_rate(requests_per_minute)
+
+    def set_rate(self, requests_per_minute):
+        """设置每分钟请求数，为空或0表示不限制"""
+        self.requests_per_minute = requests_per_minute or None
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+
+    def acquire(self):
+        """等待到允许发出下一个请求"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._next_time - now)
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait:
+            time.sleep(wait)
+
+# 服务商的每分钟请求数上限，只从部署配置读取一次，所有会话共用
+rate_limiter = RateLimiter(get_int_setting("DEEPSEEK_REQUESTS_PER_MINUTE"))
+# 批次自己的请求数限制（线程局部），只能在服务商上限之内进一步限制
+_batch_limits = threading.local()
+# 自动调整的大模型调用并发数，所有会话共用，只在进程启动时按部署配置设置一次
+concurrency_limiter = AdaptiveConcurrency(
+    initial=get_int_setting("THESIS_INITIAL_CONCURRENCY", 2),
+    max_limit=get_int_setting("THESIS_MAX_CONCURRENCY", 16),
+    enabled=str(get_setting("THESIS_ADAPTIVE_CONCURRENCY", "1")).lower() not in ("0", "false", "no")
+)
 
-# 定义每次咨询的关键字
-consultation_keywords = [
-    {"student": "选题讨论", "teacher": "方向建议"},
-    {"student": "文献综述", "teacher": "资料推荐"},
-    {"student": "研究方法", "teacher": "实验设计"},
-    {"student": "数据收集", "teacher": "分析方法"},
-    {"student": "初步结果", "teacher": "改进建议"},
-    {"student": "论文大纲", "teacher": "结构优化"},
-    {"student": "实验进展", "teacher": "数据解释"},
-    {"student": "章节撰写", "teacher": "内容审阅"},
-    {"student": "统计分析", "teacher": "结果讨论"},
-    {"student": "图表制作", "teacher": "可视化建议"},
-    {"student": "讨论部分", "teacher": "深度分析"},
-    {"student": "结论总结", "teacher": "贡献点确认"},
-    {"student": "摘要撰写", "teacher": "关键词确定"},
-    {"student": "参考文献", "teacher": "格式检查"},
-    {"student": "论文定稿", "teacher": "最终修改"},
-    {"student": "答辩准备", "teacher": "预答辩指导"}
-]
-
-def generate_all_ai_content(task_description, start_date, end_date, title, student_name, additional_info=""):
-    system_prompt = f"""
-    根据以下论文任务书描述和补充信息，为16次学生论文咨询生成内容。每次咨询包括学生信息和教师信息，具体要求如下：
-
-    基本要求：
-    1. 每条信息100-200字，确保内容充实且有实质性指导价值
-    2. 每条信息包含3-4个完整的句子
-    3. 内容具体详实，避免空泛表述，需包含具体的研究细节、方法和建议
-    4. 不要有称呼语，直接描述内容
-    5. 按照论文写作的进度逐步推进，体现研究的连续性和深入性
-    6. 每次咨询都要体现实质性进展，不能简单重复
-
-    内容要求：
-    1. 学生信息应包含：
-       - 当前工作的具体进展
-       - 遇到的具体问题或困难
-       - 已经采取的解决方案
-       - 下一步的工作计划
-
-    2. 教师信息应包含：
-       - 对学生工作的具体评价
-       - 针对性的改进建议
-       - 明确的指导方向
-       - 具体的技术或方法建议
-
-    3. 进度安排：
-       - 前5次咨询：选题定位、文献研究、方法设计阶段
-       - 中5次咨询：实验/调研实施、数据收集分析阶段
-       - 后6次咨询：论文撰写、修改完善阶段
-
-    论文信息：
-    论文题目：{title}
-    论文任务书描述：{task_description}
-    补充信息：{additional_info}
-
-    时间安排：
-    开始日期：{start_date.strftime('%Y-%m-%d')}
-    结束日期：{end_date.strftime('%Y-%m-%d')}
-
-    输出格式为JSON，包含以下字段：
-    1. consultations: 16个对象的数组，每个对象包含：
-       - date: 咨询日期
-       - student_info: 学生工作汇报（100-200字）
-       - teacher_info: 教师指导建议（100-200字）
-
-    2. work_summary: 200-300字的毕业论文工作总结，包含：
-       - 总结学生的工作态度和表现
-       - 评价研究工作的创新性和价值
-       - 对论文质量的整体评价
-       - 对学生的期望和建议
-
-    3. mid_term_review: 150-200字的中期检查评价，包含：
-       - 前期工作的具体评价
-       - 已取得的阶段性成果
-       - 存在的问题和不足
-       - 后工作的具体要求和建议
-
-    示例输出格式：
-    {{
-        "consultations": [
-            {{
-                "date": "2024-03-01",
-                "student_info": "完成了20篇核心期刊论文的系统阅读和分析，重点关注了深度学习在图像识别领域的最新进展。通过文献梳理，发现目前主要存在模型复杂度高和泛化能力不足两个问题。基于文献分析结果，初步构思了一个基于轻量级网络的改进方案，并完成了技术路线的初步设计。准备开始进行算法的详细设计和实验环境的搭建。",
-                "teacher_info": "文献综述工作比较系统，问题定位准确。建议进一步细化改进方案中的创新点，可以从模型结构优化和损失函数设计两个方向深入。同时要注意收集足够的实验数据，建议准备至少三个公开数据集进行验证。需要设计详细的对比实验方案，确保研究结果的可靠性和说服力。"
-            }}
-        ],
-        "work_summary": "该生在毕业论文研究过程中表现出色，工作态度认真负责，科研能力突出。论文选题紧跟学科前沿，具有重要的理论意义和应用价值。在研究过程中，通过大量的文献阅读和实验探索，提出了具有创新性的解决方案。实验设计严谨，数据分析深入，研究结果可靠。特别值得肯定的是，该生善于思考，能够独立解决问题，具备良好的科研素养。论文质量较高，创新点明确，实验验证充分，具有较好的学术价值和应用前景。",
-        "mid_term_review": "前期工作扎实，文献综述全面且深入，研究方案设计合理可行。已完成关键算法的设计和初步实验，取得了积极的阶段性成果。存在的问题是实验验证还需要进一步深入，数据分析有待加强。建议在后期工作中重点加强实验数据的分析深度，进一步突出研究的创新点，同时注意论文结构的逻辑性和完整性。要按计划推进实验工作，确保留出充足的论文修改时间。"
-    }}
+def use_batch_rate_limit(limiter):
+    """让当前线程的请求同时受批次的限制（用作线程池的 initializer，limiter 为空表示不额外限制）"""
+    _batch_limits.limiter = limiter
+
+def _retry_reason(error):
+    return next(reason for error_type, reason in RETRYABLE_ERRORS.items() if isinstance(error, error_type))
+
+def _retry_after(error):
+    """从错误响应的 retry-after-ms 或 Retry-After（秒数或HTTP日期）中读取建议的等待秒数，没有时返回None"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+def _retry_delay(error, attempt):
+    """第 attempt 次重试前的等待秒数"""
+    delay = RETRY_BACKOFF * 2 ** attempt
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        delay = min(max(retry_after, 0.0), MAX_RETRY_AFTER)
+    return delay * (1 + random.random() * RETRY_JITTER)
+
+def _record_usage(stage, model, messages, max_tokens, response, elapsed, usage_log):
+    usage = response.usage
+    prompt_tokens = usage.prompt_tokens if usage else 0
+    completion_tokens = usage.completion_tokens if usage else 0
+    metrics.record_llm_usage(stage, model, elapsed, prompt_tokens, completion_tokens)
+    if usage_log is not None:
+        usage_log.append({
+            "stage": stage,
+            "model": model,
+            "prompt_hash": prompt_hash(messages, model, max_tokens),
+            "latency": elapsed,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "finish_reason": response.choices[0].finish_reason
+        })
+
+def _chat_json(messages, stage_config, stage, usage_log=None):
+    """调用大模型并将返回内容解析为JSON，可选地记录耗时和token用量
+
+    限流、超时等临时错误会重试；输出达到上限被截断（finish_reason 为 length）时JSON不完整，
+    加倍输出上限后重新生成。每次完成的调用都计入用量。
     """
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": "请根据给定的论文题目和专业生成一个JSON格式的任务书描述。"}
-    ]
-
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=messages,
-        response_format={
-            'type': 'json_object'
-        }
+    model = stage_config["model"]
+    max_tokens = stage_config.get("max_tokens")
+
+    for attempt in range(MAX_RETRIES + 1):
+        kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+        batch_limiter = getattr(_batch_limits, "limiter", None)
+        if batch_limiter:
+            batch_limiter.acquire()
+        rate_limiter.acquire()
+        try:
+            with concurrency_limiter.slot() as ticket:
+                started = time.perf_counter()
+                try:
+                    response = get_client().chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        response_format={
+                            'type': 'json_object'
+                        },
+                        **kwargs
+                    )
+                except tuple(RETRYABLE_ERRORS) as e:
+                    if _retry_reason(e) in OVERLOAD_REASONS:
+                        concurrency_limiter.record_overload(ticket, _retry_reason(e))
+                    raise
+                elapsed = time.perf_counter() - started
+                concurrency_limiter.record_success(ticket, (stage, model, max_tokens), elapsed)
+        except tuple(RETRYABLE_ERRORS) as e:
+            reason = _retry_reason(e)
+            if attempt == MAX_RETRIES:
+                metrics.LLM_ERRORS.inc(stage=stage, error=reason)
+                raise
+            metrics.LLM_RETRIES.inc(stage=stage, reason=reason)
+            time.sleep(_retry_delay(e, attempt))
+            continue
+        except Exception as e:
+            metrics.LLM_ERRORS.inc(stage=stage, error=type(e).__name__)
+            raise
+
+        _record_usage(stage, model, messages, max_tokens, response, elapsed, usage_log)
+        finish_reason = response.choices[0].finish_reason
+        budget = max_tokens or DEFAULT_OUTPUT_TOKENS
+        if finish_reason != "length" or attempt == MAX_RETRIES or budget >= MAX_OUTPUT_TOKENS:
+            break
+        metrics.LLM_RETRIES.inc(stage=stage, reason="length")
+        max_tokens = min(budget * 2, MAX_OUTPUT_TOKENS)
+
+    try:
+        return json.loads(response.choices[0].message.content)
+    except ValueError:
+        metrics.LLM_ERRORS.inc(stage=stage, error="truncated" if finish_reason == "length" else "invalid_json")
+        raise
+
+def generate_all_ai_content(task_description, start_date, end_date, title, student_name, additional_info="", profile=None, usage_log=None):
+    messages = build_consultation_messages(task_description, start_date, end_date, title, additional_info, profile)
+    return _chat_json(messages, get_generation_profile(profile)["consultation"], "generate_all_ai_content", usage_log)
+
+def _neighbor_date(consultations, index, step, problems, start_date, end_date):
+    """向前（step=-1）或向后找最近的未出问题且日期有效的咨询日期，找不到时返回None"""
+    index += step
+    while 0 <= index < len(consultations):
+        consultation = consultations[index]
+        if ("consultation", index) not in problems and isinstance(consultation, dict):
+            try:
+                consultation_date = datetime.strptime(str(consultation.get("date", "")).strip(), "%Y-%m-%d").date()
+            except ValueError:
+                consultation_date = None
+            if consultation_date and start_date <= consultation_date <= end_date:
+                return consultation_date
+        index += step
+    return None
+
+def regenerate_ai_items(task_description, start_date, end_date, title, ai_content, issues, additional_info="", profile=None, usage_log=None):
+    """只重新生成未通过质量检查的咨询记录、工作总结或中期检查评价，返回合并后的内容"""
+    consultations = list(ai_content.get("consultations") or [])[:16]
+
+    # 按条目整理问题
+    problems = {}
+    for issue in issues:
+        key = ("consultation", issue["index"]) if issue["item"] == "consultation" else (issue["item"], None)
+        problems.setdefault(key, []).append(issue["problem"])
+
+    items = []
+    for (item, index), item_problems in sorted(problems.items(), key=lambda entry: (entry[0][0], entry[0][1] or 0)):
+        if item == "consultation":
+            keywords = consultation_keywords[index]
+            previous_date = _neighbor_date(consultations, index, -1, problems, start_date, end_date) or start_date
+            next_date = _neighbor_date(consultations, index, 1, problems, start_date, end_date) or end_date
+            items.append(
+                f"- 第{index + 1}次咨询（学生关键词：{keywords['student']}，教师关键词：{keywords['teacher']}，"
+                f"日期需在{previous_date}和{next_date}之间）：{'；'.join(item_problems)}"
+            )
+        elif item == "work_summary":
+            items.append(f"- 工作总结（200-300字）：{'；'.join(item_problems)}")
+        elif item == "mid_term_review":
+            items.append(f"- 中期检查评价（150-200字）：{'；'.join(item_problems)}")
+    messages = REGENERATION_PROMPT.render(
+        title=title,
+        task_description=task_description,
+        additional_info=additional_info,
+        start_date=start_date.strftime('%Y-%m-%d'),
+        end_date=end_date.strftime('%Y-%m-%d'),
+        items="\n".join(items)
     )
 
-    return json.loads(response.choices[0].message.content)
-
-def generate_consultations(task_description, start_date, end_date, title, student_name, additional_info=""):
-    consultations = []
+    result = _chat_json(messages, get_generation_profile(profile)["consultation"], "regenerate_ai_items", usage_log)
+
+    # 将重新生成的内容合并回原内容
+    for consultation in result.get("consultations") or []:
+        try:
+            index = int(consultation.get("index")) - 1
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= index < 16 or ("consultation", index) not in problems:
+            continue
+        while len(consultations) <= index:
+            consultations.append({})
+        consultations[index] = {
+            "date": consultation.get("date", ""),
+            "student_info": consultation.get("student_info", ""),
+            "teacher_info": consultation.get("teacher_info", "")
+        }
 
-    if 'ai_content' not in st.session_state:
-        st.session_state.ai_content = None
+    merged = {**ai_content, "consultations": consultations}
+    for field in ("work_summary", "mid_term_review"):
+        if (field, None) in problems and result.get(field):
+            merged[field] = result[field]
+    return merged
+
+def default_consultation_date(i, start_date, end_date):
+    """第i次咨询的默认日期：在执行期内均匀分布"""
+    return (start_date + (end_date - start_date) * i / 15).strftime("%Y-%m-%d")
+
+def init_consultation_state(ai_content=None):
+    """根据AI生成的内容初始化咨询记录，只保留渲染文档需要的字段"""
+    ai_content = ai_content or {}
+    ai_consultations = ai_content.get('consultations') or []
+    records = []
+    for i in range(16):
+        ai_consultation = ai_consultations[i] if i < len(ai_consultations) and isinstance(ai_consultations[i], dict) else {}
+        records.append({
+            # 第一次和最后一次咨询固定为开始和结束日期，None 表示使用默认日期
+            'time': None if i in (0, 15) else ai_consultation.get('date'),
+            'location': "办公",
+            'student_info': ai_consultation.get('student_info', ""),
+            'teacher_info': ai_consultation.get('teacher_info', "")
+        })
+
+    previous_version = st.session_state.get('consultation_state', {}).get('version', 0)
+    st.session_state.consultation_state = {
+        'records': records,
+        'work_summary': ai_content.get('work_summary', ""),
+        'mid_term_review': ai_content.get('mid_term_review', ""),
+        # 每次重新生成都使用新的控件key，使控件显示新生成的内容
+        'version': previous_version + 1
+    }
+
+def _save_consultation_edits(widget_key):
+    """把表格中的修改写回 consultation_state（edited_rows 是相对原始数据的全部修改，重复写入结果相同）"""
+    records = st.session_state.consultation_state['records']
+    for row, changes in st.session_state[widget_key]['edited_rows'].items():
+        for field, value in changes.items():
+            # 清空时间时恢复为默认日期
+            records[int(row)][field] = value or (None if field == 'time' else "")
+
+def _save_consultation_text(field, widget_key):
+    st.session_state.consultation_state[field] = st.session_state[widget_key]
+
+def generate_consultations(task_parts, start_date, end_date, title, student_name, additional_info="", profile=None):
+    if 'consultation_state' not in st.session_state:
+        init_consultation_state()
 
     if st.button("使用AI生成所有咨询内容、工作总结和中期检查评价"):
         with st.spinner('正在生成内容...'):
-            st.session_state.ai_content = generate_all_ai_content(task_description, start_date, end_date, title, student_name, additional_info)
-        st.success("所有内容已生成!")
-
-    # 验证AI生成的内容
-    if st.session_state.ai_content and 'consultations' in st.session_state.ai_content:
-        ai_consultations = st.session_state.ai_content['consultations']
+            # 任务书描述只在需要调用大模型时才拼接
+            task_description = build_task_description(task_parts, profile)
+            ai_content = generate_all_ai_content(task_description, start_date, end_date, title, student_name, additional_info, profile)
+        # 验证AI生成的内容
+        ai_consultations = ai_content.get('consultations') or []
         if len(ai_consultations) != 16:
             st.warning(f"AI生成的咨询记录数量不正确。预期16条，实际生成{len(ai_consultations)}条。将使用默认值填充。")
-    else:
-        ai_consultations = []
+        init_consultation_state(ai_content)
+        st.success("所有内容已生成!")
 
-    for i in range(16):
-        st.text(f"咨询 {i+1}")
-        
-        if i < len(ai_consultations):
-            if i == 0:
-                default_date = start_date.strftime("%Y-%m-%d")
-            elif i == 15:
-                default_date = end_date.strftime("%Y-%m-%d")
-            else:
-                default_date = ai_consultations[i].get('date', (start_date + (end_date - start_date) * i / 15).strftime("%Y-%m-%d"))
-            default_student_info = ai_consultations[i].get('student_info', "")
-            default_teacher_info = ai_consultations[i].get('teacher_info', "")
-        else:
-            if i == 0:
-                default_date = start_date.strftime("%Y-%m-%d")
-            elif i == 15:
-                default_date = end_date.strftime("%Y-%m-%d")
-            else:
-                default_date = (start_date + (end_date - start_date) * i / 15).strftime("%Y-%m-%d")
-            default_student_info = ""
-            default_teacher_info = ""
-        
-        time = st.text_input(f"时间", value=default_date, key=f"time_{i}")
-        location = st.text_input(f"地点", value="办公", key=f"location_{i}")
-        
-        student_input = st.text_area(f"学生信息 (关键词: {consultation_keywords[i]['student']})", 
-                                     value=default_student_info,
-                                     key=f"student_input_{i}")
-        teacher_input = st.text_area(f"教师信息 (关键词: {consultation_keywords[i]['teacher']})", 
-                                     value=default_teacher_info,
-                                     key=f"teacher_input_{i}")
-        
-        consultation = {
+    state = st.session_state.consultation_state
+    version = state['version']
+
+    # 16条咨询记录放在同一个表格中编辑（一个控件），编辑结果通过回调保存到 consultation_state
+    rows = [
+        {
             'id': i + 1,
-            'time': time,
-            'location': location,
-            'student_info': student_input,
-            'teacher_info': teacher_input
+            'keywords': f"{consultation_keywords[i]['student']} / {consultation_keywords[i]['teacher']}",
+            'time': record['time'] or default_consultation_date(i, start_date, end_date),
+            'location': record['location'],
+            'student_info': record['student_info'],
+            'teacher_info': record['teacher_info']
         }
-        consultations.append(consultation)
-    
-
-
-    # 显示中期检查评价
-    if st.session_state.ai_content and 'mid_term_review' in st.session_state.ai_content:
-        mid_term_review = st.text_area("中期检查评价（可编辑）", value=st.session_state.ai_content['mid_term_review'], height=200)
-    else:
-        mid_term_review = st.text_area("中期检查评价（可编辑）", value="", height=200)
-
-     # 显示工作总结
-    if st.session_state.ai_content and 'work_summary' in st.session_state.ai_content:
-        work_summary = st.text_area("工作总结（可编辑）", value=st.session_state.ai_content['work_summary'], height=300)
-    else:
-        work_summary = st.text_area("工作总结（可编辑）", value="", height=300)
-    
-    return consultations, work_summary, mid_term_review
-
-def generate_task_description(title, major, start_date, end_date, additional_info=""):
-    total_weeks = ((end_date - start_date).days + 1) // 7
-    system_prompt = f"""
-    请根据给定的论文题目、专业、时间范围和补充信息，生成一份详细的毕业论文任务书描述。描述应包括以下5个部分，并以JSON格式输出：
-
-    论文题目：{title}
-    专业：{major}
-    补充信息：{additional_info}
-
-    1. 课题的任务内容：
-       - 须融入论文选题内容，不少于100字
-       - 阐述选题的研究背景和现实意义
-       - 明确研究目标和预期成果
-       - 说明研究的创新点和应用价值
-       - 指出研究的重点和难点
-       - 说明研究的理论和实践意义
-       - 阐述研究的可行性分析
-
-    2. 原始条件及数据：
-       - 说明完成论文所需的基础知识和技能要求
-       - 列出必要的软硬件环境和工具
-       - 明确数据来源和获取方式
-       - 说明数据的类型和规模
-       - 规定数据的质量要求
-       - 说明数据的预处理方法
-       - 规定数据的存储和管理方式
-
-    3. 设计的技术要求（论文的研究要求）：
-       - 详细说明研究方法和技术路线
-       - 提出具体的技术指标和参数要求
-       - 规定实验或调研的具体要求
-       - 明确数据处理和分析方法
-       - 提出创新性要求和技术突破点
-       - 说明研究的可验证性
-       - 规定研究结果的评价标准
-
-    4. 毕业设计（论文）应完成的具体工作：
-       A. 基本要求（通用部分）：
-          1. 文献综述和开题报告：
-             - 开题报告成绩要求70分以上合格
-             - 文献综述字数2500字左右
-             - 开题报告需包含研究计划和预期目标
-          2. 外文翻译：
-             - 翻译一篇与选题相关的英文文献
-             - 字数要求20000英文印刷字符以上
-             - 翻译质量要准确、通顺
-          3. 调研工作：
-             - 进行实地调研或实验研究
-             - 调研报告字数3000字左右
-             - 需包含数据分析和结果讨论
-          4. 论文撰写：
-             - 论文总字数1.5~2万字
-             - 符合学校论文格式规范
-             - 完成导师要求的修改
-          5. 论文答辩：
-             - 准备答辩PPT和讲稿
-             - 参加答辩并回答问题
-             - 总分60分以上为通过
-
-       B. 研究工作（根据论文题目"{title}"和专业"{major}"生成具体内容）：
-          1. 理论研究部分：
-             - 系统梳理本研究领域的理论基础
-             - 构建适合研究问题的理论框架
-             - 提出研究假设或理论模型
-             - 确定关键变量和影响因素
-          2. 研究方法部分：
-             - 设计详细的研究方案
-             - 确定研究方法和技术路线
-             - 制定数据收集和分析计划
-             - 建立评估指标体系
-          3. 实验/调研部分：
-             - 开展实验或调研工作
-             - 收集和整理原始数据
-             - 进行数据预处理和分析
-             - 验证研究假设
-          4. 创新工作部分：
-             - 提出创新性的解决方案
-             - 设计和实施对比实验
-             - 总结研究的创新点
-             - 验证创新成果的有效性
-          5. 应用研究部分：
-             - 选择典型案例进行分析
-             - 进行实践应用验证
-             - 评估应用效果
-             - 总结实践价值和推广意义
-
-    5. 资料文献要求及主要的参考文献：
-       - 文献数量要求：
-         * 外文文献不少于4篇
-         * 中文文献不少于16篇
-         * 核心期刊文献占比不低于50%
-       - 文献时效性要求：
-         * 近五年文献占比不少于50%
-         * 需包含最新研究进展
-       - 文献搜索途径：
-         * 外文数据库：Web of Science、Scopus、IEEE Xplore等
-         * 中文数据库：CNKI、万方、维普等
-         * 学术搜索引擎：Google Scholar、百度学术等
-       - 文献类型要求：
-         * 以学术期刊论文为主
-         * 必须包含核心期刊文献
-         * 可包含高水平会议论文
-         * 可包含优秀博硕士论文
-       - 文献引用规范：
-         * 遵守学术规范
-         * 注意避免过度引用
-         * 引用格式符合要求
-       - 建议关键词：根据论文主题提供5-8个核心关键词
-       - 推荐经典文献：列出3-5篇该领域的经典或高被引文献
-
-    请确保生成的内容：
-    1. 专业性：使用专业术语和表达方式
-    2. 针对性：内容与论文题目和专业紧密相关
-    3. 可操作性：要求具体明确，便于执行
-    4. 完整性：覆盖论文写作的各个环节
-    5. 规范性：符合学术规范和学校要求
-    6. 总字数：控制在1000字左右
-
-    请生成一个JSON格式的输出，每个部分作为一个单独的字段。对于每个字段，如果内容包含多个要点，请使用数组格式，每个要点作为数组的一个元素。
-
-    输出的JSON格式示例：
-    {{
-        "task_content": [
-            "1. 研究背景：...(详细阐述选题背景和意义，不少于100字)",
-            "2. 研究目标：...(明确具体的研究目标)",
-            "3. 创新点：...(说明研究的创新之处)",
-            "4. 研究重点和难点：...(指出关键问题)",
-            "5. 理论和实践意义：...(阐述研究价值)",
-            "6. 可行性分析：...(说明研究的可行性)"
-        ],
-        "original_conditions": [
-            "1. 基础知识要求：...(列出必备知识)",
-            "2. 环境和工具要求：...(说明所需环境)",
-            "3. 数据来源：...(明确数据来源)",
-            "4. 数据类型：...(说明数据类型)",
-            "5. 数据规模：...(规定数据规模)",
-            "6. 数据质量：...(说明质量要求)",
-            "7. 数据管理：...(规定管理方式)"
-        ],
-        "technical_requirements": [
-            "1. 研究方法：...(详述研究方法)",
-            "2. 技术指标：...(列出具体指标)",
-            "3. 实验要求：...(说明实验规范)",
-            "4. 数据分析方法：...(规定分析方法)",
-            "5. 创新性要求：...(提出创新要求)",
-            "6. 可验证性：...(说明验证方法)",
-            "7. 评价标准：...(规定评价标准)"
-        ],
-        "specific_work": [
-            "A. 基本要求（通用部分）：",
-            "1. 文献综述和开题报告：",
-            "   - 开题报告成绩要求70分以上合格",
-            "   - 文献综述字数2500字左右",
-            "   - 开题报告需包含研究计划和预期目标",
-            "2. 外文翻译：",
-            "   - 翻译一篇与选题相关的英文文献",
-            "   - 字数要求20000英文印刷字符以上",
-            "   - 翻译质量要准确、通顺",
-            "3. 调研工作：",
-            "   - 进行实地调研或实验研究",
-            "   - 调研报告字数3000字左右",
-            "   - 需包含数据分析和结果讨论",
-            "4. 论文撰写：",
-            "   - 论文总字数1.5~2万字",
-            "   - 符合学校论文格式规范",
-            "   - 完成导师要求的修改",
-            "5. 论文答辩：",
-            "   - 准备答辩PPT和讲稿",
-            "   - 参加答辩并回答问题",
-            "   - 总分60分以上为通过",
-            "",
-            "B. 研究工作（具体内容）：",
-            "1. 理论研究：[根据论文题目生成具体的理论研究任务]",
-            "2. 研究方法：[根据论文题目生成具体的研究方法]",
-            "3. 实验/调研：[根据论文题目生成具体的实验或调研任务]",
-            "4. 创新工作：[根据论文题目生成具体的创新任务]",
-            "5. 应用研究：[根据论文题目生成具体的应用研究任务]"
-        ],
-        "reference_requirements": [
-            "1. 文献数量和类型要求：",
-            "   - 外文文献不少于4篇",
-            "   - 中文文献不少于16篇",
-            "   - 核心期刊文献占比不低于50%",
-            "2. 文献时效性要求：",
-            "   - 近五年文献占比不少于50%",
-            "   - 需包含最新研究进展",
-            "3. 文献搜索途径：",
-            "   - 外文数据库：Web of Science、Scopus、IEEE Xplore等",
-            "   - 中文数据库：CNKI、万方、维普等",
-            "   - 学术搜索引擎：Google Scholar、百度学术等",
-            "4. 文献引用规范：",
-            "   - 遵守学术规范",
-            "   - 注意避免过度引用",
-            "   - 引用格式符合要求",
-            "5. 建议关键词：[与论文主题相关的5-8个关键词]",
-            "6. 推荐经典文献：[3-5篇该领域的经典或高被引文献]"
-        ]
-    }}
-    """
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": "请根据给定的论文题目和专业生成一个JSON格式的任务书描述。"}
+        for i, record in enumerate(state['records'])
     ]
-
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=messages,
-        response_format={
-            'type': 'json_object'
+    widget_key = f"consultations_{version}"
+    st.data_editor(
+        rows,
+        key=widget_key,
+        on_change=_save_consultation_edits,
+        args=(widget_key,),
+        hide_index=True,
+        num_rows="fixed",
+        disabled=('id', 'keywords'),
+        column_config={
+            'id': st.column_config.NumberColumn("次数", width="small"),
+            'keywords': st.column_config.TextColumn("关键词（学生 / 教师）"),
+            'time': st.column_config.TextColumn("时间", width="small"),
+            'location': st.column_config.TextColumn("地点", width="small"),
+            'student_info': st.column_config.TextColumn("学生信息", width="large"),
+            'teacher_info': st.column_config.TextColumn("教师信息", width="large")
         }
     )
 
-    return json.loads(response.choices[0].message.content)
+    # 显示中期检查评价和工作总结
+    for field, label, height in (
+        ('mid_term_review', "中期检查评价（可编辑）", 200),
+        ('work_summary', "工作总结（可编辑）", 300)
+    ):
+        widget_key = f"{field}_{version}"
+        st.text_area(label, value=state[field], height=height, key=widget_key, on_change=_save_consultation_text, args=(field, widget_key))
+
+def collect_consultations(start_date, end_date):
+    """按模板需要的格式整理咨询记录、工作总结和中期检查评价"""
+    state = st.session_state.consultation_state
+    consultations = [
+        {
+            'id': i + 1,
+            'time': record['time'] or default_consultation_date(i, start_date, end_date),
+            'location': record['location'],
+            'student_info': record['student_info'],
+            'teacher_info': record['teacher_info']
+        }
+        for i, record in enumerate(state['records'])
+    ]
+    return consultations, state['work_summary'], state['mid_term_review']
+
+@st.cache_data
+def load_template_bytes(path):
+    """读取模板文件内容（在所有会话之间共享）"""
+    with open(path, "rb") as f:
+        return f.read()
+
+def generate_task_description(title, major, start_date, end_date, additional_info="", profile=None, usage_log=None):
+    messages = build_task_messages(title, major, start_date, end_date, additional_info, profile)
+    return _chat_json(messages, get_generation_profile(profile)["task"], "generate_task_description", usage_log)
 
 def main():
+    metrics.start_exporter()
     st.title("毕业论文归档材料生成器")
 
     # 主页面用户输入
@@ -437,6 +434,13 @@ def main():
 
     mid_date = start_date + (end_date - start_date) / 2
 
+    profile = st.selectbox(
+        "生成配置",
+        list(GENERATION_PROFILES),
+        index=list(GENERATION_PROFILES).index(DEFAULT_PROFILE),
+        help="“精简”配置要求的条目数和字数更少，并只将任务书的任务内容和技术要求作为咨询内容的生成依据，生成速度更快。"
+    )
+
     student_signature_file = st.file_uploader("上传学生签名图片（可选）", type=["png", "jpg", "jpeg"])
     teacher_signature_file = st.file_uploader("上传教师签名图片（必需）", type=["png", "jpg", "jpeg"])
     dean_signature_file = st.file_uploader("上传系主任签名图片（必需）", type=["png", "jpg", "jpeg"])
@@ -449,35 +453,18 @@ def main():
         
         # 初始化 task_parts
         if 'task_parts' not in st.session_state:
-            st.session_state.task_parts = {
-                "task_content": [],
-                "original_conditions": [],
-                "technical_requirements": [],
-                "specific_work": [],
-                "reference_requirements": [],
-                "schedule": []
-            }
+            st.session_state.task_parts = {key: "" for key, _ in TASK_PARTS}
         
         if st.button("生成任务书内容"):
             with st.spinner("正在生成任务书内容..."):
-                task_content = generate_task_description(title, major, start_date, end_date, additional_info)
+                task_content = generate_task_description(title, major, start_date, end_date, additional_info, profile)
             
             # 更新 session_state 中的 task_parts
             st.session_state.task_parts = task_content
         
         # 显示生成的内容并允许编辑
-        for i, (key, part_name) in enumerate([
-            ("task_content", "课题的任务内容"),
-            ("original_conditions", "原始条件及数据"),
-            ("technical_requirements", "设计的技术要求"),
-            ("specific_work", "应完成的具体工作"),
-            ("reference_requirements", "资料文献要求")
-        ]):
-            content = st.session_state.task_parts.get(key, [])
-            if isinstance(content, list):
-                formatted_content = "\n".join(content)
-            else:
-                formatted_content = content
+        for i, (key, part_name) in enumerate(TASK_PARTS):
+            formatted_content = format_task_part(st.session_state.task_parts.get(key, []))
             
             st.session_state.task_parts[key] = st.text_area(
                 f"{i+1}. {part_name}", 
@@ -498,7 +485,7 @@ def main():
             else:
                 try:
                     # 加载任务书模板
-                    task_doc = DocxTemplate("thesis_task_description_template.docx")
+                    task_doc = DocxTemplate(io.BytesIO(load_template_bytes("thesis_task_description_template.docx")))
                     
                     # 在这里创建 InlineImage 对象
                     teacher_signature = InlineImage(task_doc, teacher_signature_file, width=Mm(20))
@@ -524,11 +511,13 @@ def main():
                         task_context['student_signature'] = InlineImage(task_doc, student_signature_file, width=Mm(20))
                     
                     # 渲染模板
-                    task_doc.render(task_context)
+                    with metrics.TEMPLATE_RENDER_SECONDS.time(template="thesis_task_description_template"):
+                        task_doc.render(task_context)
                     
                     # 保存生成的文档到内存中
                     output = io.BytesIO()
-                    task_doc.save(output)
+                    with metrics.DOCX_SAVE_SECONDS.time(template="thesis_task_description_template"):
+                        task_doc.save(output)
                     output.seek(0)
 
                     # 提供下载链接
@@ -543,17 +532,15 @@ def main():
                     st.exception(e)
 
     with tab2:
-        # 加载模板
-        doc = DocxTemplate("student_consultation_template.docx")
-
         if teacher_signature_file and st.session_state.task_parts:
-            # 使用任务书内容生成咨询记录
-            task_description = "\n".join(["\n".join(st.session_state.task_parts[key]) for key in st.session_state.task_parts])
-            
             # 生成咨询记录、工作总结和中期检查评价
-            consultations, work_summary, mid_term_review = generate_consultations(task_description, start_date, end_date, title, student_name, additional_info)
+            generate_consultations(st.session_state.task_parts, start_date, end_date, title, student_name, additional_info, profile)
 
             if st.button("生成咨询记录"):
+                # 只在需要生成文档时才加载模板
+                doc = DocxTemplate(io.BytesIO(load_template_bytes("student_consultation_template.docx")))
+                consultations, work_summary, mid_term_review = collect_consultations(start_date, end_date)
+
                 # 加载签名图片
                 teacher_signature = InlineImage(doc, teacher_signature_file, width=Mm(20))
 
@@ -579,11 +566,13 @@ def main():
                 if student_signature_file:
                     context['student_signature'] = InlineImage(doc, student_signature_file, width=Mm(20))
 
-                doc.render(context)
+                with metrics.TEMPLATE_RENDER_SECONDS.time(template="student_consultation_template"):
+                    doc.render(context)
 
                 # 保存生成的文档到内存中
                 output = io.BytesIO()
-                doc.save(output)
+                with metrics.DOCX_SAVE_SECONDS.time(template="student_consultation_template"):
+                    doc.save(output)
                 output.seek(0)
 
                 # 提供下载链接